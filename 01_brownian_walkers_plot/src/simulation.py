@@ -1,7 +1,6 @@
 from collections.abc import Callable
 from particle import Particle
 import numpy as np
-import matplotlib.pyplot as plt
 import json
 
 # A class representing a simulation
@@ -65,6 +64,9 @@ class Simulation:
     # Make a plot of the simulation using matplotlib and show it to the user
     # If save_to is specified, the plot is saved to whatever directory is specified by the user.
     def plot(self, save_to: str =None):
+        # Imported here, so running a simulation doesn't need matplotlib
+        import matplotlib.pyplot as plt
+
         # Parameters to make the plots look a bit nicer
         params = {
             'axes.titlesize': 14,
@@ -0,0 +1,423 @@
+import numpy as np
+
+
+# Streaming accumulator for the mean, variance and the third and fourth central moments of a set of values.
+# Every element of an array of the given shape is tracked separately (for example, one per bin),
+# so a whole histogram can be added to it in one call without ever storing the past samples.
+# Updates use Welford's algorithm, and accumulators can be merged using the pairwise formulas of Chan et al. and Pébay,
+# which lets us combine statistics from different bins, shards of a run, or replicas of a simulation.
+class RunningMoments:
+    def __init__(self, shape=()):
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)         # The sums of the 2nd, 3rd and 4th powers of the deviations from the mean
+        self.m3 = np.zeros(shape)
+        self.m4 = np.zeros(shape)
+
+
+    # Adds one sample to every element.
+    # values must have the same shape as the accumulator.
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+
+        self.count += 1
+        n = self.count
+
+        delta = values - self.mean
+        delta_n = delta / n
+        delta_n2 = delta_n * delta_n
+        term = delta * delta_n * (n - 1)
+
+        # The order matters here, since each moment is updated using the old values of the lower ones
+        self.mean += delta_n
+        self.m4 += term * delta_n2 * (n * n - 3 * n + 3) + 6 * delta_n2 * self.m2 - 4 * delta_n * self.m3
+        self.m3 += term * delta_n * (n - 2) - 3 * delta_n * self.m2
+        self.m2 += term
+
+
+    # Adds several samples to every element at once.
+    # values has shape (samples, *shape). The batch's moments are computed directly and then merged in.
+    def update_batch(self, values):
+        values = np.asarray(values)
+        if len(values) == 0:
+            return
+
+        # Flattened to (samples, elements), so the products can be summed as they're made by einsum
+        deviations = values.reshape(len(values), -1).astype(float)
+        mean = deviations.mean(axis=0)
+        deviations -= mean
+        squares = deviations * deviations
+
+        m2 = squares.sum(axis=0)
+        m3 = np.einsum('ij,ij->j', squares, deviations)
+        m4 = np.einsum('ij,ij->j', squares, squares)
+
+        shape = self.mean.shape
+        self.merge_raw(len(values), mean.reshape(shape), m2.reshape(shape), m3.reshape(shape), m4.reshape(shape))
+
+
+    # Merges the samples of another accumulator with the same shape into this one
+    def merge(self, other: 'RunningMoments') -> 'RunningMoments':
+        self.merge_raw(*other.raw())
+
+        return self
+
+
+    # Merges a group of samples, given its count and moments, into this accumulator in place,
+    # with the pairwise formulas of Chan et al. and Pébay. Only arrays the size of one sample are made.
+    def merge_raw(self, count, mean, m2, m3, m4):
+        n_a = self.count.astype(float)
+        n_b = np.asarray(count, dtype=float)
+        n = n_a + n_b
+        safe_n = np.maximum(n, 1)
+
+        delta = mean - self.mean
+        delta_n = delta / safe_n
+        delta_n2 = delta_n * delta_n
+        term = delta * delta_n * n_a * n_b
+
+        # The order matters here, since each moment is updated using the old values of the lower ones
+        self.m4 += m4 + term * delta_n2 * (n_a * n_a - n_a * n_b + n_b * n_b) \
+            + 6 * delta_n2 * (n_a * n_a * m2 + n_b * n_b * self.m2) + 4 * delta_n * (n_a * m3 - n_b * self.m3)
+        self.m3 += m3 + term * delta_n * (n_a - n_b) + 3 * delta_n * (n_a * m2 - n_b * self.m2)
+        self.m2 += m2 + term
+        self.mean += delta_n * n_b
+        self.count += np.asarray(count, dtype=np.int64)
+
+
+    # Combines the elements along the given axis (or all of them) into a single set of moments.
+    # This is how the per-bin statistics are pooled into statistics over every bin.
+    def pooled(self, axis=None) -> 'RunningMoments':
+        result = RunningMoments()
+        result.count, result.mean, result.m2, result.m3, result.m4 = RunningMoments.combine(*self.raw(), axis=axis)
+
+        return result
+
+
+    # Combines groups of samples, given the count and moments of every group, along an axis.
+    # d is the difference between each group's mean and the combined mean.
+    @staticmethod
+    def combine(count, mean, m2, m3, m4, axis=None) -> tuple:
+        total = np.sum(count, axis=axis)
+        safe_total = np.maximum(total, 1)
+        combined_mean = np.sum(count * mean, axis=axis) / safe_total
+
+        d = mean - (np.expand_dims(combined_mean, axis) if axis is not None else combined_mean)
+        d2 = d * d
+
+        combined_m2 = np.sum(m2 + count * d2, axis=axis)
+        combined_m3 = np.sum(m3 + 3 * d * m2 + count * d2 * d, axis=axis)
+        combined_m4 = np.sum(m4 + 4 * d * m3 + 6 * d2 * m2 + count * d2 * d2, axis=axis)
+
+        return total, combined_mean, combined_m2, combined_m3, combined_m4
+
+
+    # Returns the moments of the values multiplied by factor, like converting counts to densities
+    def scaled(self, factor: float) -> 'RunningMoments':
+        result = RunningMoments(self.mean.shape)
+        result.count = self.count.copy()
+        result.mean = self.mean * factor
+        result.m2 = self.m2 * factor ** 2
+        result.m3 = self.m3 * factor ** 3
+        result.m4 = self.m4 * factor ** 4
+
+        return result
+
+
+    def raw(self) -> tuple:
+        return self.count, self.mean, self.m2, self.m3, self.m4
+
+
+    # The population variance, which is what np.var computes
+    @property
+    def variance(self):
+        return self.m2 / np.maximum(self.count, 1)
+
+
+    @property
+    def skewness(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.sqrt(self.count) * self.m3 / self.m2 ** 1.5
+
+
+    # The excess kurtosis, which is 0 for a normal distribution
+    @property
+    def kurtosis(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.count * self.m4 / self.m2 ** 2 - 3
+
+
+    # Helper serialization method
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count.tolist(),
+            'mean': self.mean.tolist(),
+            'm2': self.m2.tolist(),
+            'm3': self.m3.tolist(),
+            'm4': self.m4.tolist(),
+        }
+
+
+    # Helper deserialization method
+    @staticmethod
+    def from_dict(data: dict) -> 'RunningMoments':
+        moments = RunningMoments()
+        moments.count = np.asarray(data['count'], dtype=np.int64)
+        moments.mean = np.asarray(data['mean'], dtype=float)
+        moments.m2 = np.asarray(data['m2'], dtype=float)
+        moments.m3 = np.asarray(data['m3'], dtype=float)
+        moments.m4 = np.asarray(data['m4'], dtype=float)
+
+        return moments
+
+
+# Streaming histogram of a stream of values, with bins that are fixed up front.
+# Values outside the bins are counted as underflow or overflow, so nothing is silently dropped.
+# Like RunningMoments, two histograms with the same bins can be merged, so shards and replicas can be combined.
+class ValueHistogram:
+    def __init__(self, edges):
+        self.edges = np.asarray(edges, dtype=float)
+        self.counts = np.zeros(len(self.edges) - 1, dtype=np.int64)
+        self.underflow = 0
+        self.overflow = 0
+
+        # Bins made by for_integers are evenly spaced and centered between integers, so integer values can be
+        # binned with integer arithmetic instead of a search. This is the (first integer, width) of those bins.
+        self.integer_bins = None
+        shifted = self.edges + 0.5
+        widths = np.diff(shifted)
+        if len(widths) > 0 and np.all(shifted == np.round(shifted)) and np.all(widths == widths[0]):
+            self.integer_bins = (int(shifted[0]), int(widths[0]))
+
+
+    # Makes a histogram for integer values (like particle counts or bin crossings) with the given mean and variance.
+    # The bins are centered on the integers and span the given number of standard deviations on each side.
+    # If that would take more than max_bins bins, several integers share a bin.
+    @staticmethod
+    def for_integers(mean: float, var: float, sigmas: float = 5, max_bins: int = 1000) -> 'ValueHistogram':
+        sigma = np.sqrt(var)
+        left = int(np.floor(mean - sigmas * sigma))
+        right = int(np.ceil(mean + sigmas * sigma))
+
+        width = max(1, int(np.ceil((right - left + 1) / max_bins)))
+        edges = np.arange(left, right + width + 1, width) - 0.5
+
+        return ValueHistogram(edges)
+
+
+    # Counts every value in the given array
+    def update(self, values):
+        values = np.ravel(values)
+
+        if self.integer_bins is not None and values.dtype.kind in 'iu':
+            self.update_integers(values)
+            return
+
+        # Same convention as np.histogram: every bin is half open, except for the last one which includes its right edge
+        index = np.searchsorted(self.edges, values, side='right') - 1
+        index[values == self.edges[-1]] = len(self.counts) - 1
+
+        below = index < 0
+        above = index >= len(self.counts)
+        self.underflow += int(np.count_nonzero(below))
+        self.overflow += int(np.count_nonzero(above))
+
+        inside = ~(below | above)
+        self.counts += np.bincount(index[inside], minlength=len(self.counts))
+
+
+    # Counts integer values into integer bins. Underflow and overflow get a bin of their own at either end,
+    # so a single bincount does everything.
+    def update_integers(self, values: np.ndarray):
+        first, width = self.integer_bins
+        bins = len(self.counts)
+
+        index = values.astype(np.int64) - first
+        if width > 1:
+            index //= width
+        np.clip(index, -1, bins, out=index)
+        index += 1
+
+        tally = np.bincount(index, minlength=bins + 2)
+        self.underflow += int(tally[0])
+        self.overflow += int(tally[-1])
+        self.counts += tally[1:-1]
+
+
+    # Merges the counts of another histogram with the same bins into this one
+    def merge(self, other: 'ValueHistogram') -> 'ValueHistogram':
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("Can only merge histograms with the same bins")
+
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+
+        return self
+
+
+    # Returns the same histogram for the values multiplied by a positive factor, like converting counts to densities
+    def scaled(self, factor: float) -> 'ValueHistogram':
+        result = ValueHistogram(self.edges * factor)
+        result.counts = self.counts.copy()
+        result.underflow = self.underflow
+        result.overflow = self.overflow
+
+        return result
+
+
+    # The total number of values counted, including the ones outside the bins
+    def total(self) -> int:
+        return int(self.counts.sum()) + self.underflow + self.overflow
+
+
+    # The probability density in every bin, normalized over the values inside the bins like ax.hist(density=True)
+    def density(self) -> np.ndarray:
+        inside = max(int(self.counts.sum()), 1)
+
+        return self.counts / (inside * np.diff(self.edges))
+
+
+    # Helper serialization method
+    def to_dict(self) -> dict:
+        return {
+            'edges': self.edges.tolist(),
+            'counts': self.counts.tolist(),
+            'underflow': self.underflow,
+            'overflow': self.overflow,
+        }
+
+
+    # Helper deserialization method
+    @staticmethod
+    def from_dict(data: dict) -> 'ValueHistogram':
+        histogram = ValueHistogram(data['edges'])
+        histogram.counts = np.asarray(data['counts'], dtype=np.int64)
+        histogram.underflow = data['underflow']
+        histogram.overflow = data['overflow']
+
+        return histogram
+
+
+# Streaming statistics of counts (like bin crossings) summed over time windows of 1, 2, 4, ... steps.
+# Level k keeps the moments of the sums over consecutive, non-overlapping windows of 2^k steps.
+# Every window that completes at one level is half of a window of the next, so each step is only carried up
+# as far as the windows it completes, which is O(1) work per step on average. Apart from its moments,
+# a level only holds the one window waiting for its partner, so the memory is O(log steps) per element.
+class FluxPyramid:
+    def __init__(self, shape=()):
+        self.shape = tuple(int(n) for n in np.atleast_1d(shape))
+        self.levels = []        # The moments of the window sums, one RunningMoments per level
+        self.pending = []       # The last window of every level, if it is still waiting for its partner, or None
+
+        # Windows of a single step are the counts themselves, so their level is always there
+        self.add_level()
+
+
+    # The window sizes, in steps, that there are statistics for
+    @property
+    def windows(self) -> list[int]:
+        return [2 ** level for level in range(len(self.levels))]
+
+
+    # The moments of the sums over windows of the given number of steps, which must be a power of 2
+    def moments(self, window: int) -> RunningMoments:
+        if window not in self.windows:
+            raise ValueError(f"There are no statistics for windows of {window} steps, only for {self.windows}")
+
+        return self.levels[window.bit_length() - 1]
+
+
+    def add_level(self):
+        self.levels.append(RunningMoments(self.shape))
+        self.pending.append(None)
+
+
+    # Adds the counts of one step
+    def update(self, values):
+        values = np.asarray(values, dtype=np.int64)
+
+        level = 0
+        while True:
+            if level == len(self.levels):
+                self.add_level()
+
+            self.levels[level].update(values)
+
+            if self.pending[level] is None:
+                self.pending[level] = values.copy()
+                return
+
+            # Two windows of this level make one of the next
+            values = self.pending[level] + values
+            self.pending[level] = None
+            level += 1
+
+
+    # Adds the counts of several steps at once, given as a (steps, *shape) array.
+    # Each level's windows are the pairwise sums of the level below, made in a single pass, and everything ends up
+    # exactly as if the steps had been added one by one. A level only exists once a window of its size has been seen,
+    # so there are never more than log2(steps) + 1 of them.
+    def update_batch(self, values):
+        sums = np.asarray(values)
+
+        level = 0
+        while len(sums) > 0:
+            if level == len(self.levels):
+                self.add_level()
+            self.levels[level].update_batch(sums)
+
+            # A window left waiting by an earlier update pairs up with the first one of this batch
+            waiting = self.pending[level]
+            rest = sums if waiting is None else sums[1:]
+            pairs = len(rest) // 2
+
+            # Left with an odd window, it waits for its partner just as it would have if added one step at a time
+            self.pending[level] = rest[-1].astype(np.int64) if len(rest) % 2 == 1 else None
+
+            offset = 0 if waiting is None else 1
+            next_sums = np.empty((offset + pairs, *self.shape), dtype=np.int64)
+            if waiting is not None:
+                np.add(waiting, sums[0], out=next_sums[0], dtype=np.int64)
+            np.add(rest[0:2 * pairs:2], rest[1:2 * pairs:2], out=next_sums[offset:], dtype=np.int64)
+
+            sums = next_sums
+            level += 1
+
+
+    # Helper serialization method
+    def to_dict(self) -> dict:
+        return {
+            'shape': list(self.shape),
+            'levels': [level.to_dict() for level in self.levels],
+            'pending': [None if pending is None else pending.tolist() for pending in self.pending],
+        }
+
+
+    # Helper deserialization method
+    @staticmethod
+    def from_dict(data: dict) -> 'FluxPyramid':
+        pyramid = FluxPyramid(tuple(data['shape']))
+        if data['levels']:
+            pyramid.levels = [RunningMoments.from_dict(level) for level in data['levels']]
+            pyramid.pending = [None if pending is None else np.asarray(pending, dtype=np.int64)
+                               for pending in data['pending']]
+
+        return pyramid
+
+
+# The mean and variance of the number density in a cell, for N particles spread uniformly over [0, L]
+# This comes from my analysis: the count in a cell is binomial with p = 1 / num_x
+def expected_density_stats(num_particles: int, L: float, num_x: int) -> tuple[float, float]:
+    n = num_particles / L
+    dx = L / num_x
+
+    return n, n / dx * (1 - 1 / num_x)
+
+
+# The mean and variance of the flux through a boundary, for N particles spread uniformly over [0, L]
+# This also comes from my analysis
+def expected_flux_stats(num_particles: int, L: float, D: float, dt: float) -> tuple[float, float]:
+    n = num_particles / L
+
+    return 0, 2 * n * np.sqrt(D / (np.pi * dt ** 3))
@@ -0,0 +1,22 @@
+from contextlib import contextmanager
+import os
+
+# Files that other processes read while they're being rewritten (results, checkpoints, status files and figures)
+# are written under a temporary name next to them, and only moved into place once they're complete.
+# os.replace is atomic, so readers see either the old file or the new one, never half of one.
+
+
+# Yields the temporary path to write to, and moves it to path once the block finishes.
+# If the block fails, the temporary file is removed and path is left as it was.
+# The process id is part of the temporary name, so processes writing the same file don't clash.
+@contextmanager
+def atomic_path(path: str):
+    temp_path = f"{path}.{os.getpid()}.tmp"
+
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
@@ -0,0 +1,326 @@
+import matplotlib
+matplotlib.use('Agg')   # Plots are rendered off screen, so nothing blocks and the timings don't include a window
+
+import matplotlib.pyplot as plt
+from simulation import Simulation
+from ensemble import Ensemble
+from particle import Particle
+import numpy as np
+import tracemalloc
+import argparse
+import tempfile
+import warnings
+import solutions
+import correlations
+import diffusion
+import plots
+import time
+import json
+import os
+
+# A benchmark suite for the hot paths of the simulation, its I/O, the analytics and the plots.
+# Every benchmark reports its throughput and peak memory, and can be compared against a stored baseline
+# to catch regressions. Run it with:
+#   python benchmarks.py                    compare against the baseline
+#   python benchmarks.py --save-baseline    record the current numbers as the new baseline
+# The committed baseline was measured on a single machine, so the rates only compare well on similar hardware.
+# On a different machine, save a baseline from an unchanged checkout first, and compare against that.
+
+baseline_path = "../benchmarks/baseline.json"
+
+# Every benchmark registers itself here, by name
+BENCHMARKS = {}
+
+
+# Registers a benchmark. The decorated function does any setup and returns (run, work),
+# where run is the callable being timed and work is how many units (given by unit) one call of it processes.
+def benchmark(name: str, unit: str):
+    def register(function):
+        BENCHMARKS[name] = (function, unit)
+        return function
+
+    return register
+
+
+def make_config(num_particles: int, num_x: int, D: float = 1, seed: int = 0) -> dict:
+    return {
+        'L': 100,
+        'num_particles': num_particles,
+        'dt': 0.25,
+        'D': D,
+        'seed': seed,
+        'histogram_config': {'num_x': num_x, 'num_t': 100, 'number_density': True},
+    }
+
+
+# Every particle starting in the middle, like the experiments with flux plots
+CENTERED = {'type': 'delta', 'x0': 0.5}
+
+
+# A simulation that has already been run, for the benchmarks that work on its results
+def make_simulation(num_particles: int = 1000, num_x: int = 20, steps: int = 200,
+                    initial_condition: dict = None) -> Simulation:
+    config = make_config(num_particles, num_x)
+    if initial_condition is not None:
+        config['initial_condition'] = initial_condition
+
+    simulation = Simulation(config)
+    simulation.run_steps(steps)
+
+    return simulation
+
+
+# The engine, across numbers of particles and bins
+for num_particles in (10, 100, 1000):
+    for num_x in (20, 200):
+        def engine(num_particles=num_particles, num_x=num_x):
+            simulation = Simulation(make_config(num_particles, num_x))
+            steps = max(2000 // num_particles, 10)
+
+            return lambda: simulation.run_steps(steps), steps * num_particles
+
+        def ensemble(num_particles=num_particles, num_x=num_x):
+            replicas = max(10000 // num_particles, 1)
+            simulation = Ensemble(make_config(num_particles, num_x, seed=1), replicas)
+
+            return lambda: simulation.run_steps(10), 10 * replicas * num_particles
+
+        benchmark(f"engine/simulation/N={num_particles}/num_x={num_x}", 'particle-steps')(engine)
+        benchmark(f"engine/ensemble/N={num_particles}/num_x={num_x}", 'particle-steps')(ensemble)
+
+
+@benchmark("engine/step/N=1000", 'particle-steps')
+def single_step():
+    simulation = Simulation(make_config(1000, 20))
+    return simulation.step, 1000
+
+
+# Large jumps cross many boundaries, which is the slow path of get_crossings
+@benchmark("particle/get_crossings/large_jumps", 'crossings')
+def get_crossings():
+    rng = np.random.default_rng(0)
+    old = rng.random(1000) * 100
+    new = old + rng.normal(0, 500, 1000)
+    particles = [Particle(x, 200) for x in new]
+
+    def run():
+        for particle, old_x in zip(particles, old):
+            particle.get_crossings(100, old_x)
+
+    crossings = int(np.sum(np.abs(np.floor(new / 100 * 200) - np.floor(old / 100 * 200))))
+    return run, crossings
+
+
+@benchmark("analytics/generate_hist", 'histograms')
+def generate_hist():
+    simulation = make_simulation()
+    return simulation.generate_hist, simulation.histogram_config['num_t']
+
+
+@benchmark("analytics/generate_single_hist_at", 'histograms')
+def generate_single_hist_at():
+    simulation = make_simulation()
+    return lambda: simulation.generate_single_hist_at(100), 1
+
+
+@benchmark("analytics/flux_autocorrelation", 'steps')
+def flux_autocorrelation():
+    simulation = make_simulation(100, 200, 2000)
+    return lambda: correlations.flux_autocorrelation(simulation, 100), simulation.current_step
+
+
+@benchmark("analytics/flux_spectrum", 'steps')
+def flux_spectrum():
+    simulation = make_simulation(100, 200, 2000)
+    return lambda: correlations.flux_spectrum(simulation), simulation.current_step
+
+
+@benchmark("analytics/measure_diffusion", 'particle-steps')
+def measure_diffusion():
+    simulation = make_simulation(1000, 20, 1000)
+    return lambda: diffusion.measure_diffusion(simulation), simulation.num_particles * simulation.current_step
+
+
+@benchmark("io/to_json", 'bytes')
+def to_json():
+    simulation = make_simulation()
+    return simulation.to_json, len(simulation.to_json())
+
+
+@benchmark("io/open", 'bytes')
+def open_json():
+    simulation = make_simulation()
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "simulation.json")
+    simulation.save_to(path)
+
+    return lambda: Simulation.open(path), os.path.getsize(path)
+
+
+@benchmark("io/to_txt", 'bytes')
+def to_txt():
+    simulation = make_simulation()
+    return simulation.to_txt, len(simulation.to_txt())
+
+
+# Every analytic solution, evaluated the way the plots use them
+for name in ('get_fourier_func', 'get_fourier_bound_func', 'get_gaussian_func', 'get_gaussian_bound_func'):
+    def solution(name=name):
+        simulation = make_simulation(100, 20, 10, initial_condition=CENTERED)
+        x_values = np.linspace(0, simulation.L, 250)
+
+        def run():
+            f = getattr(solutions, name)(simulation, 10)
+            for x in x_values:
+                f(x, 5.0)
+
+        return run, len(x_values)
+
+    benchmark(f"solutions/{name}", 'evaluations')(solution)
+
+
+# The plots, each drawn on a fresh figure and then rendered
+def render(draw) -> callable:
+    def run():
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')     # plt.show warns that Agg can't show anything
+            fig, ax = plt.subplots()
+            draw(ax)
+            fig.canvas.draw()
+            plt.close('all')
+
+    return run
+
+
+@benchmark("plots/plot", 'figures')
+def plot():
+    simulation = make_simulation(100, 20, 200)
+    return render(lambda ax: plots.plot(simulation, ax)), 1
+
+
+@benchmark("plots/plot_kymograph", 'figures')
+def plot_kymograph():
+    simulation = make_simulation(1000, 20, 200, initial_condition=CENTERED)
+    return render(lambda ax: plots.plot_kymograph(simulation, ax, theory='gaussian')), 1
+
+
+@benchmark("plots/plot_hist_at_step", 'figures')
+def plot_hist_at_step():
+    simulation = make_simulation(1000, 20, 50, initial_condition=CENTERED)
+    return render(lambda ax: plots.plot_hist_at_step(simulation, 25, ax, flux=True)), 1
+
+
+# The flux stems are the slow part of a histogram with many bins
+@benchmark("plots/plot_hist_at_step/10000 bins", 'figures')
+def plot_hist_at_step_many_bins():
+    simulation = make_simulation(1000, 10000, 50, initial_condition=CENTERED)
+    return render(lambda ax: plots.plot_hist_at_step(simulation, 25, ax, flux=True)), 1
+
+
+@benchmark("plots/plot_aggregated_hists", 'figures')
+def plot_aggregated_hists():
+    simulation = make_simulation(1000, 20, 100)
+    return render(lambda ax: plots.plot_aggregated_hists(simulation, ax)), 1
+
+
+@benchmark("plots/plot_flux_hists", 'figures')
+def plot_flux_hists():
+    simulation = make_simulation(1000, 20, 100)
+    return render(lambda ax: plots.plot_flux_hists(simulation, ax)), 1
+
+
+@benchmark("plots/plot_hists_generated", 'figures')
+def plot_hists_generated():
+    simulation = make_simulation(1000, 20, 50, initial_condition=CENTERED)
+    simulation.histogram_config['num_t'] = 20
+    return render(lambda ax: plots.plot_hists_generated(simulation)), 1
+
+
+# Times a benchmark, keeping the best of several repeats, and measures its peak memory in a separate run
+# (since tracing memory slows everything down)
+def measure(name: str, repeat: int = 3) -> dict:
+    function, unit = BENCHMARKS[name]
+    run, work = function()
+
+    run()   # Warm up
+
+    best = float('inf')
+    for i in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'seconds': best, 'rate': work / best, 'unit': f"{unit}/second", 'peak_bytes': peak}
+
+
+def load_baseline(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def save_baseline(results: dict, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=2, sort_keys=True)
+
+
+# Runs every benchmark whose name contains the filter, prints a report, and returns the results
+# along with the names of the ones that got slower than the baseline by more than threshold
+def run_benchmarks(name_filter: str = "", baseline: dict = None, threshold: float = 0.2,
+                   repeat: int = 3) -> tuple[dict, list[str]]:
+    baseline = baseline or {}
+    results = {}
+    regressions = []
+
+    print(f"{'benchmark':<48}{'rate':>16}  {'unit':<26}{'peak memory':>14}{'vs baseline':>14}")
+    for name in BENCHMARKS:
+        if name_filter not in name:
+            continue
+
+        result = measure(name, repeat)
+        results[name] = result
+
+        comparison = ""
+        if name in baseline:
+            change = result['rate'] / baseline[name]['rate'] - 1
+            comparison = f"{change:+.1%}"
+            if change < -threshold:
+                regressions.append(name)
+                comparison += " !!"
+
+        print(f"{name:<48}{result['rate']:>16.4g}  {result['unit']:<26}"
+              f"{result['peak_bytes'] / 1024 ** 2:>11.2f} MB{comparison:>14}")
+
+    return results, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the simulation, its I/O, analytics and plots")
+    parser.add_argument('filter', nargs='?', default="", help="Only run benchmarks whose name contains this")
+    parser.add_argument('--baseline', default=baseline_path)
+    parser.add_argument('--save-baseline', action='store_true', help="Save the results as the new baseline")
+    parser.add_argument('--threshold', type=float, default=0.2, help="Slowdown that counts as a regression")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.baseline)
+    results, regressions = run_benchmarks(args.filter, baseline, args.threshold, args.repeat)
+
+    if args.save_baseline:
+        save_baseline({**baseline, **results}, args.baseline)
+        print(f"baseline saved to {args.baseline}")
+    elif regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}: {', '.join(regressions)}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
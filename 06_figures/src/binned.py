@@ -0,0 +1,196 @@
+from crossings import coarsen_occupancy, coarsen_crossings, window_sums
+from accumulators import RunningMoments, ValueHistogram, FluxPyramid, expected_density_stats, expected_flux_stats
+import numpy as np
+
+# About how many counts the streaming statistics are updated with at once.
+# That's enough to make a batch cost next to nothing per step, and few enough to keep its temporary arrays small.
+STATISTICS_BATCH = 2 ** 20
+
+
+# One of the streaming statistics. Rather than being updated every step, the statistics are caught up
+# with the stored counts a batch at a time, and whenever one of them is read.
+def statistic(name: str) -> property:
+    def get(self):
+        self.flush_statistics()
+        return self.__dict__[name]
+
+    def set(self, value):
+        self.__dict__[name] = value
+
+    return property(get, set)
+
+
+# The binned statistics shared by Simulation and Ensemble, read from what both of them keep:
+# the occupancy_history and bin_crossings count arrays, whose rows are (num_x,) for a simulation
+# and (R, num_x) for an ensemble, and the streaming accumulators of those rows.
+# The accumulators hold raw counts, which are converted to number densities and fluxes here.
+# With keep_counts off, the rows are dropped once they are in the statistics, so a long run only ever holds
+# about one batch of them. Everything that needs the counts of every step then raises instead.
+class BinnedStatistics:
+    occupancy_moments = statistic('occupancy_moments')
+    crossing_moments = statistic('crossing_moments')
+    occupancy_histogram = statistic('occupancy_histogram')
+    crossing_histogram = statistic('crossing_histogram')
+    flux_pyramid = statistic('flux_pyramid')
+
+
+    # Sets up empty streaming statistics of the occupancy and the crossings of every bin.
+    # Whatever history there already is gets added the first time they are read.
+    def init_statistics(self):
+        shape = self.occupancy_history.row_shape
+        num_x = self.histogram_config['num_x']
+
+        self.occupancy_moments = RunningMoments(shape)
+
+        # The crossings summed over windows of 1, 2, 4, ... steps, for the flux at longer time scales.
+        # Windows of one step are the crossings themselves, so their moments are shared rather than computed twice.
+        pyramid = FluxPyramid(shape)
+        self.flux_pyramid = pyramid
+        self.crossing_moments = pyramid.moments(1)
+
+        # The bins of the value histograms are chosen from the analytic mean and variance, converted to counts
+        dx = self.L / num_x
+        mean, var = expected_density_stats(self.num_particles, self.L, num_x)
+        self.occupancy_histogram = ValueHistogram.for_integers(mean * dx, var * dx ** 2)
+
+        mean, var = expected_flux_stats(self.num_particles, self.L, self.D, self.dt)
+        self.crossing_histogram = ValueHistogram.for_integers(mean * self.dt, var * self.dt ** 2)
+
+        # How many rows of the occupancy are in the statistics so far
+        self.statistics_step = 0
+
+
+    # How many steps go into a batch
+    def batch_steps(self) -> int:
+        return max(STATISTICS_BATCH // int(np.prod(self.occupancy_history.row_shape)), 1)
+
+
+    # Adds every stored step that isn't in the statistics yet, a batch at a time.
+    # The "0th" bin crossing is just padding, so it is left out.
+    def flush_statistics(self):
+        statistics = self.__dict__
+        first = self.occupancy_history.first
+        steps = first + len(self.occupancy_history)
+        batch = self.batch_steps()
+
+        # The rows are indexed from the first one still stored, which is the first step unless older rows were dropped
+        for start in range(self.statistics_step, steps, batch):
+            occupancy = self.occupancy_history[start - first:start - first + batch]
+            crossings = self.bin_crossings[max(start, 1) - first:start - first + batch]
+
+            # This also updates crossing_moments, which is the first level of the pyramid
+            statistics['flux_pyramid'].update_batch(crossings)
+
+            statistics['occupancy_moments'].update_batch(occupancy)
+            statistics['occupancy_histogram'].update(occupancy)
+            statistics['crossing_histogram'].update(crossings)
+
+        self.statistics_step = steps
+
+        if not self.keep_counts:
+            self.occupancy_history.drop()
+            self.bin_crossings.drop()
+
+
+    # Called after every step, and only does any work once a full batch of steps is waiting
+    def update_statistics_batch(self):
+        steps = self.occupancy_history.first + len(self.occupancy_history)
+        if steps - self.statistics_step >= self.batch_steps():
+            self.flush_statistics()
+
+
+    # Everything that reads the counts of every step needs them to have been kept
+    def require_counts(self):
+        if not self.keep_counts:
+            raise ValueError("This run was made with keep_counts off, so only its streaming statistics were kept. "
+                             "Coarser grids, sampled histograms and flux windows that aren't powers of 2 "
+                             "need the counts of every step: rerun it with keep_counts on.")
+
+
+    # The number of particles in every cell at every step, as a (steps, ..., num_x) array view.
+    # The counts are binned at the num_x of the histogram config, but any coarser num_x that divides it
+    # can be asked for as well, and is made by adding up neighbouring cells.
+    def get_occupancy(self, num_x: int = None) -> np.ndarray:
+        self.require_counts()
+        if num_x is None:
+            return self.occupancy_history.array
+
+        return coarsen_occupancy(self.occupancy_history.array, num_x)
+
+
+    # The net crossings of every boundary at every step, as a (steps, ..., num_x) array, at any num_x that divides
+    # the histogram config's. The first row is the "0th" crossing.
+    def get_crossings(self, num_x: int = None) -> np.ndarray:
+        self.require_counts()
+        if num_x is None:
+            return self.bin_crossings.array
+
+        return coarsen_crossings(self.bin_crossings.array, num_x)
+
+
+    # Whether num_x asks for a coarser grid than the one the counts are binned at
+    def is_coarser(self, num_x: int) -> bool:
+        return num_x is not None and num_x != self.histogram_config['num_x']
+
+
+    # The per-bin moments of the number density (or particle count, if number_density is off),
+    # with one set per replica for an ensemble. Use pooled() for a single set of numbers.
+    # For a coarser num_x, they are computed from the stored occupancy rather than streamed, so that needs keep_counts.
+    def get_density_moments(self, num_x: int = None) -> RunningMoments:
+        moments = self.occupancy_moments
+        if self.is_coarser(num_x):
+            occupancy = self.get_occupancy(num_x)
+            moments = RunningMoments(occupancy.shape[1:])
+            moments.update_batch(occupancy)
+        else:
+            num_x = self.histogram_config['num_x']
+
+        if self.histogram_config['number_density']:
+            return moments.scaled(num_x / self.L)
+
+        return moments
+
+
+    # The per-boundary moments of the flux, in particles per unit time.
+    # window averages the flux over that many steps, as if the simulation had been run with a dt window times as long.
+    # Windows that are powers of 2 were accumulated as the simulation ran. Any other window, or a coarser num_x,
+    # is summed from the stored crossings instead, so that needs keep_counts.
+    def get_flux_moments(self, num_x: int = None, window: int = 1) -> RunningMoments:
+        if self.is_coarser(num_x) or window not in self.flux_pyramid.windows:
+            sums = window_sums(self.get_crossings(num_x)[1:], window)
+            moments = RunningMoments(sums.shape[1:])
+            moments.update_batch(sums)
+        elif window == 1:
+            moments = self.crossing_moments
+        else:
+            moments = self.flux_pyramid.moments(window)
+
+        return moments.scaled(1 / (window * self.dt))
+
+
+    # The distribution of the number density (or particle count) values, pooled over every bin, step and replica
+    def get_density_histogram(self, num_x: int = None) -> ValueHistogram:
+        histogram = self.occupancy_histogram
+        if self.is_coarser(num_x):
+            dx = self.L / num_x
+            mean, var = expected_density_stats(self.num_particles, self.L, num_x)
+            histogram = ValueHistogram.for_integers(mean * dx, var * dx ** 2)
+            histogram.update(self.get_occupancy(num_x))
+        else:
+            num_x = self.histogram_config['num_x']
+
+        if self.histogram_config['number_density']:
+            return histogram.scaled(num_x / self.L)
+
+        return histogram
+
+
+    # The distribution of the flux values, pooled over every boundary, step and replica
+    def get_flux_histogram(self, num_x: int = None) -> ValueHistogram:
+        histogram = self.crossing_histogram
+        if self.is_coarser(num_x):
+            mean, var = expected_flux_stats(self.num_particles, self.L, self.D, self.dt)
+            histogram = ValueHistogram.for_integers(mean * self.dt, var * self.dt ** 2)
+            histogram.update(self.get_crossings(num_x)[1:])
+
+        return histogram.scaled(1 / self.dt)
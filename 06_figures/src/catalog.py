@@ -0,0 +1,225 @@
+from simulation import Simulation
+from accumulators import RunningMoments
+import warnings
+import sqlite3
+import glob
+import json
+import os
+
+# The columns every run is indexed by, along with their SQL types
+COLUMNS = {
+    'path': 'TEXT UNIQUE NOT NULL',
+    'modified': 'REAL',
+    'L': 'REAL',
+    'num_particles': 'INTEGER',
+    'dt': 'REAL',
+    'D': 'REAL',
+    'num_x': 'INTEGER',
+    'num_t': 'INTEGER',
+    'number_density': 'INTEGER',
+    'steps': 'INTEGER',
+    'seed': 'INTEGER',
+    'record_history': 'INTEGER',
+    'density_mean': 'REAL',
+    'density_var': 'REAL',
+    'flux_mean': 'REAL',
+    'flux_var': 'REAL',
+    'params': 'TEXT',
+}
+
+# The columns worth searching on, which get an index
+INDEXED = ('num_particles', 'D', 'dt', 'num_x', 'L', 'steps')
+
+# What every saved simulation has, and other json files (like cluster state or status files) don't
+SIMULATION_KEYS = ('L', 'num_particles', 'dt', 'D', 'histogram_config', 'current_step', 'particles')
+
+
+# A lightweight reference to a saved simulation, as returned by a catalog query.
+# The indexed values are available right away as attributes, while the simulation itself is only read
+# from disk the first time open is called.
+class RunHandle:
+    def __init__(self, row: sqlite3.Row):
+        for key in row.keys():
+            setattr(self, key, row[key])
+
+        self.params = json.loads(self.params)
+        self.simulation = None
+
+
+    # Loads the simulation this handle refers to, and keeps it around for the next call
+    def open(self) -> Simulation:
+        if self.simulation is None:
+            self.simulation = Simulation.open(self.path)
+
+        return self.simulation
+
+
+    def __repr__(self):
+        return f"RunHandle({self.path}, N={self.num_particles}, D={self.D}, dt={self.dt}, steps={self.steps})"
+
+
+# A local sqlite database indexing saved simulations by their parameters and summary statistics,
+# so that post-processing can find the runs it needs without opening every file in the output directory.
+class Catalog:
+    def __init__(self, path: str = "../../out/catalog.sqlite"):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+
+        columns = ", ".join(f"{name} {kind}" for name, kind in COLUMNS.items())
+        self.connection.execute(f"CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, {columns})")
+        for name in INDEXED:
+            self.connection.execute(f"CREATE INDEX IF NOT EXISTS runs_{name} ON runs ({name})")
+
+        self.connection.commit()
+
+        # The files index_directory couldn't index, with the reason why
+        self.skipped = {}
+
+
+    # Adds a saved simulation to the catalog, or updates it if the file changed since it was last indexed.
+    # Returns True if the file had to be read. Raises a ValueError if the file isn't a simulation.
+    def index(self, path: str) -> bool:
+        path = os.path.abspath(path)
+        modified = os.path.getmtime(path)
+
+        row = self.connection.execute("SELECT modified FROM runs WHERE path = ?", (path,)).fetchone()
+        if row is not None and row['modified'] == modified:
+            return False
+
+        with open(path, 'r') as file:
+            json_data = json.load(file)
+
+        missing = [key for key in SIMULATION_KEYS if key not in json_data]
+        if missing:
+            raise ValueError(f"{path} isn't a saved simulation, it has no {', '.join(missing)}")
+
+        values = Catalog.summarize(json_data)
+        values['path'] = path
+        values['modified'] = modified
+
+        names = list(values.keys())
+        self.connection.execute(
+            f"INSERT OR REPLACE INTO runs ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})",
+            [values[name] for name in names],
+        )
+        self.connection.commit()
+
+        return True
+
+
+    # Indexes every saved simulation in a directory matching the given pattern.
+    # Other json files in the directory, and simulations that can't be loaded, are skipped with a warning,
+    # and listed in skipped. Returns how many files had to be read.
+    def index_directory(self, directory: str = "../../out", pattern: str = "*.json") -> int:
+        count = 0
+        for path in sorted(glob.glob(os.path.join(directory, pattern))):
+            try:
+                if self.index(path):
+                    count += 1
+            except ValueError as e:
+                self.skipped[os.path.abspath(path)] = str(e)
+                warnings.warn(f"Skipped {path}: {e}")
+
+        return count
+
+
+    # Works out the values to index a simulation by, from the data it was saved with.
+    # Newer files carry their streaming statistics, so computing the summary is cheap.
+    # Older ones are loaded as a simulation, which recomputes them from the history.
+    @staticmethod
+    def summarize(json_data: dict) -> dict:
+        config = json_data['histogram_config']
+        num_x = config['num_x']
+
+        if 'occupancy_moments' in json_data.keys():
+            occupancy = RunningMoments.from_dict(json_data['occupancy_moments'])
+            crossings = RunningMoments.from_dict(json_data['crossing_moments'])
+        else:
+            simulation = Simulation.from_dict(json_data)
+            occupancy = simulation.occupancy_moments
+            crossings = simulation.crossing_moments
+
+        density = occupancy.pooled()
+        if config['number_density']:
+            density = density.scaled(num_x / json_data['L'])
+        flux = crossings.pooled().scaled(1 / json_data['dt'])
+
+        params = {key: value for key, value in json_data.items()
+                  if key in ('L', 'num_particles', 'dt', 'D', 'histogram_config', 'seed', 'record_history')}
+
+        return {
+            'L': json_data['L'],
+            'num_particles': json_data['num_particles'],
+            'dt': json_data['dt'],
+            'D': json_data['D'],
+            'num_x': num_x,
+            'num_t': config['num_t'],
+            'number_density': int(config['number_density']),
+            'steps': json_data['current_step'] - 1,
+            'seed': json_data.get('seed'),
+            'record_history': int(json_data.get('record_history', True)),
+            'density_mean': float(density.mean),
+            'density_var': float(density.variance),
+            'flux_mean': float(flux.mean),
+            'flux_var': float(flux.variance),
+            'params': json.dumps(params),
+        }
+
+
+    # Finds the runs matching every filter, as lightweight handles.
+    # A filter is a column name with either a value to match exactly, or a (low, high) tuple for an inclusive range,
+    # where either end can be None. For example, query(D=10, num_particles=(1000, None), order_by='flux_var')
+    def query(self, order_by: str = None, limit: int = None, **filters) -> list[RunHandle]:
+        clauses = []
+        arguments = []
+
+        for name, value in filters.items():
+            if name not in COLUMNS:
+                raise ValueError(f"Unknown column '{name}'")
+
+            if isinstance(value, tuple):
+                low, high = value
+                if low is not None:
+                    clauses.append(f"{name} >= ?")
+                    arguments.append(low)
+                if high is not None:
+                    clauses.append(f"{name} <= ?")
+                    arguments.append(high)
+            elif value is None:
+                clauses.append(f"{name} IS NULL")
+            else:
+                clauses.append(f"{name} = ?")
+                arguments.append(value)
+
+        statement = "SELECT * FROM runs"
+        if clauses:
+            statement += " WHERE " + " AND ".join(clauses)
+
+        if order_by is not None:
+            descending = order_by.startswith('-')
+            name = order_by.lstrip('-')
+            if name not in COLUMNS:
+                raise ValueError(f"Unknown column '{name}'")
+            statement += f" ORDER BY {name}{' DESC' if descending else ''}"
+
+        if limit is not None:
+            statement += " LIMIT ?"
+            arguments.append(limit)
+
+        return [RunHandle(row) for row in self.connection.execute(statement, arguments)]
+
+
+    # Removes the runs whose files no longer exist. Returns how many were removed.
+    def prune(self) -> int:
+        missing = [row['path'] for row in self.connection.execute("SELECT path FROM runs")
+                   if not os.path.exists(row['path'])]
+
+        self.connection.executemany("DELETE FROM runs WHERE path = ?", [(path,) for path in missing])
+        self.connection.commit()
+
+        return len(missing)
+
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,400 @@
+from ensemble import Ensemble
+from sweep import expand_grid, config_hash
+from atomic import atomic_path
+import socketserver
+import threading
+import argparse
+import socket
+import json
+import time
+import uuid
+import os
+
+# A minimal job queue for running sweeps on several machines (or several processes on one machine).
+# The coordinator holds the list of jobs and serves them over TCP, and workers pull jobs, run them and push
+# the results back. Every message is a single line of json, and every connection carries a single request.
+#
+# Jobs are leased to a worker for a while, and the worker keeps the lease alive with heartbeats.
+# If a worker dies, its lease runs out and the job is handed to someone else, up to max_attempts times.
+# The state of every job is saved to a json file after every change, so a coordinator can be restarted
+# and pick up where it left off.
+
+
+# The fields every kind of message needs, besides its type
+MESSAGE_FIELDS = {
+    'request': ('worker',),
+    'heartbeat': ('worker', 'job_id'),
+    'result': ('worker', 'job_id', 'result'),
+    'failure': ('worker', 'job_id', 'error'),
+}
+
+
+# Raised inside a worker when the coordinator takes its job back
+class JobCancelled(Exception):
+    pass
+
+
+# Sends one message and waits for the reply
+def send_message(host: str, port: int, message: dict, timeout: float = 30) -> dict:
+    with socket.create_connection((host, port), timeout=timeout) as connection:
+        connection.sendall((json.dumps(message) + "\n").encode())
+
+        with connection.makefile('r') as file:
+            return json.loads(file.readline())
+
+
+class Coordinator:
+    # jobs is a list of {'config': ..., 'steps': ...} dictionaries.
+    # If a state file from an earlier coordinator exists, the jobs in it are resumed instead.
+    def __init__(self, jobs: list[dict], state_path: str, host: str = "127.0.0.1", port: int = 5555,
+                 lease: float = 30, max_attempts: int = 3):
+        self.state_path = state_path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+
+        # When every worker was last heard from, and which of them were told there's nothing left to do
+        self.workers = {}
+        self.dismissed = set()
+
+        if os.path.exists(state_path):
+            with open(state_path, 'r') as file:
+                self.jobs = json.load(file)
+
+            # Whoever was running these before is gone now
+            for job in self.jobs.values():
+                if job['status'] == 'running':
+                    job['status'] = 'pending'
+        else:
+            self.jobs = {}
+            for job in jobs:
+                job_id = config_hash(job['config'], job['steps'])
+                self.jobs[job_id] = {
+                    'id': job_id,
+                    'config': job['config'],
+                    'steps': job['steps'],
+                    'status': 'pending',
+                    'attempts': 0,
+                    'worker': None,
+                    'lease_until': None,
+                    'error': None,
+                    'result': None,
+                }
+
+        self.save_state()
+
+        coordinator = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    message = json.loads(self.rfile.readline())
+                except ValueError as e:
+                    reply = {'type': 'error', 'error': f"Messages must be a single line of json ({e})"}
+                else:
+                    reply = coordinator.handle(message)
+                self.wfile.write((json.dumps(reply) + "\n").encode())
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.address = self.server.server_address
+
+
+    # Writes the state of every job to disk, through a temporary file so it's never half written
+    def save_state(self):
+        with atomic_path(self.state_path) as temp_path:
+            with open(temp_path, 'w') as file:
+                json.dump(self.jobs, file)
+
+
+    # Answers a single message from a worker. Messages that don't make sense get an error back, and change nothing.
+    def handle(self, message: dict) -> dict:
+        with self.lock:
+            error = self.check_message(message)
+            if error is not None:
+                return {'type': 'error', 'error': error}
+
+            self.expire_leases()
+            self.workers[message['worker']] = time.time()
+
+            kind = message['type']
+            if kind == 'request':
+                reply = self.assign(message['worker'])
+            elif kind == 'heartbeat':
+                reply = self.heartbeat(message['worker'], message['job_id'])
+            elif kind == 'result':
+                reply = self.complete(message['worker'], message['job_id'], message['result'])
+            else:
+                reply = self.fail(message['worker'], message['job_id'], message['error'])
+
+            self.save_state()
+            return reply
+
+
+    # Returns what's wrong with a message, or None if it can be handled
+    def check_message(self, message) -> str:
+        if not isinstance(message, dict):
+            return "Messages must be json objects"
+
+        kind = message.get('type')
+        if kind not in MESSAGE_FIELDS:
+            return f"Unknown message type '{kind}'"
+
+        missing = [field for field in MESSAGE_FIELDS[kind] if field not in message]
+        if missing:
+            return f"'{kind}' messages need {', '.join(missing)}"
+
+        if not isinstance(message['worker'], str):
+            return "The worker must be a string"
+
+        if 'job_id' in message and message['job_id'] not in self.jobs:
+            return f"Unknown job '{message['job_id']}'"
+
+        return None
+
+
+    # Puts the jobs whose worker stopped sending heartbeats back in the queue
+    def expire_leases(self):
+        now = time.time()
+        for job in self.jobs.values():
+            if job['status'] == 'running' and job['lease_until'] < now:
+                self.fail(job['worker'], job['id'], f"Lease expired on worker {job['worker']}")
+
+
+    def assign(self, worker: str) -> dict:
+        for job in self.jobs.values():
+            if job['status'] == 'pending':
+                job['status'] = 'running'
+                job['worker'] = worker
+                job['attempts'] += 1
+                job['lease_until'] = time.time() + self.lease
+
+                return {'type': 'job', 'job': {key: job[key] for key in ('id', 'config', 'steps')}, 'lease': self.lease}
+
+        if self.finished():
+            self.dismissed.add(worker)
+            return {'type': 'shutdown'}
+
+        # Everything left is being run by someone else, but might come back if they fail
+        return {'type': 'wait'}
+
+
+    def heartbeat(self, worker: str, job_id: str) -> dict:
+        job = self.jobs.get(job_id)
+        if job is None or job['status'] != 'running' or job['worker'] != worker:
+            # The job was reassigned, so this worker should give up on it
+            return {'type': 'cancel'}
+
+        job['lease_until'] = time.time() + self.lease
+        return {'type': 'ok'}
+
+
+    def complete(self, worker: str, job_id: str, result: dict) -> dict:
+        job = self.jobs[job_id]
+        if not isinstance(result, dict):
+            return {'type': 'error', 'error': "The result must be a json object"}
+
+        # A late result is still a valid result, as long as nobody finished the job first
+        if job['status'] != 'done':
+            job['status'] = 'done'
+            job['worker'] = worker
+            job['result'] = result
+
+        return {'type': 'ok'}
+
+
+    def fail(self, worker: str, job_id: str, error: str) -> dict:
+        job = self.jobs.get(job_id)
+        if job is None or job['status'] != 'running' or job['worker'] != worker:
+            # A late failure from a worker whose lease expired, which mustn't undo the work of whoever has the job now
+            return {'type': 'ok'}
+
+        job['error'] = error
+        job['worker'] = None
+        job['status'] = 'failed' if job['attempts'] >= self.max_attempts else 'pending'
+
+        return {'type': 'ok'}
+
+
+    def finished(self) -> bool:
+        return all(job['status'] in ('done', 'failed') for job in self.jobs.values())
+
+
+    # The results of every finished job, by job id
+    def results(self) -> dict[str, dict]:
+        with self.lock:
+            return {job_id: job['result'] for job_id, job in self.jobs.items() if job['status'] == 'done'}
+
+
+    # Serves jobs until every one of them is done or has failed too many times.
+    # Idle workers only find out there's nothing left when they next ask, so the coordinator keeps answering
+    # for up to linger seconds afterwards, until every worker heard from in that time has been told to shut down.
+    # Otherwise they'd be left retrying a closed port until they give up.
+    def serve_until_finished(self, poll: float = 0.5, linger: float = 10):
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+
+        try:
+            while True:
+                with self.lock:
+                    self.expire_leases()
+                    if self.finished():
+                        self.save_state()
+                        break
+                time.sleep(poll)
+
+            deadline = time.time() + linger
+            while time.time() < deadline:
+                with self.lock:
+                    now = time.time()
+                    waiting = [worker for worker, last_seen in self.workers.items()
+                               if worker not in self.dismissed and now - last_seen < linger]
+                if not waiting:
+                    break
+                time.sleep(poll)
+        finally:
+            self.shutdown()
+
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# Runs one job with the vectorized engine, and returns only the compact statistics instead of the full history.
+# If cancelled is set while it runs, the job is abandoned with a JobCancelled error.
+def run_job(job: dict, cancelled: threading.Event = None) -> dict:
+    config = dict(job['config'], record_history=False)
+    ensemble = Ensemble(config)
+
+    for i in range(job['steps']):
+        if cancelled is not None and cancelled.is_set():
+            raise JobCancelled(f"Job {job['id']} was taken back by the coordinator")
+        ensemble.step()
+
+    return {
+        'steps': job['steps'],
+        'replicas': ensemble.replicas,
+        'occupancy_moments': ensemble.occupancy_moments.to_dict(),
+        'crossing_moments': ensemble.crossing_moments.to_dict(),
+        'occupancy_histogram': ensemble.occupancy_histogram.to_dict(),
+        'crossing_histogram': ensemble.crossing_histogram.to_dict(),
+        'flux_pyramid': ensemble.flux_pyramid.to_dict(),
+    }
+
+
+# Pulls jobs from a coordinator and runs them until there are none left.
+# While a job is running, a background thread keeps its lease alive. If the coordinator says the job is no longer
+# this worker's (its lease ran out and someone else has it), the job is abandoned and the worker asks for another.
+# If the coordinator can't be reached for give_up_after seconds, it's assumed to be gone for good.
+def run_worker(host: str, port: int, worker: str = None, heartbeat: float = None, retry_delay: float = 1,
+               give_up_after: float = 60):
+    if worker is None:
+        worker = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+    last_contact = time.time()
+    while True:
+        try:
+            reply = send_message(host, port, {'type': 'request', 'worker': worker})
+            last_contact = time.time()
+        except OSError:
+            # The coordinator might be restarting, so try again in a bit
+            if time.time() - last_contact > give_up_after:
+                return
+            time.sleep(retry_delay)
+            continue
+
+        if reply['type'] == 'shutdown':
+            return
+        if reply['type'] == 'wait':
+            time.sleep(retry_delay)
+            continue
+        if reply['type'] == 'error':
+            raise ValueError(f"The coordinator refused the request: {reply['error']}")
+
+        job = reply['job']
+        interval = heartbeat if heartbeat is not None else reply['lease'] / 3
+        running = threading.Event()
+        running.set()
+        cancelled = threading.Event()
+
+        def keep_alive():
+            while running.is_set():
+                time.sleep(interval)
+                if not running.is_set():
+                    break
+                try:
+                    reply = send_message(host, port, {'type': 'heartbeat', 'worker': worker, 'job_id': job['id']})
+                except OSError:
+                    continue
+
+                # An error means the coordinator doesn't know the job anymore, which is no better
+                if reply['type'] in ('cancel', 'error'):
+                    cancelled.set()
+                    break
+
+        thread = threading.Thread(target=keep_alive, daemon=True)
+        thread.start()
+
+        try:
+            message = {'type': 'result', 'worker': worker, 'job_id': job['id'], 'result': run_job(job, cancelled)}
+        except JobCancelled:
+            # Whoever has the job now will report it, so there's nothing to send
+            continue
+        except Exception as e:
+            message = {'type': 'failure', 'worker': worker, 'job_id': job['id'], 'error': repr(e)}
+        finally:
+            running.clear()
+
+        # Keep trying to deliver the result for a while, since it would be a waste to lose it
+        deadline = time.time() + give_up_after
+        while True:
+            try:
+                send_message(host, port, message)
+                last_contact = time.time()
+                break
+            except OSError:
+                if time.time() > deadline:
+                    return
+                time.sleep(retry_delay)
+
+
+# Reads a sweep description: a json file with a base config, a grid of values to expand it over, and a step count
+def load_sweep(path: str) -> list[dict]:
+    with open(path, 'r') as file:
+        sweep = json.load(file)
+
+    return [{'config': config, 'steps': sweep['steps']} for config in expand_grid(sweep['base'], sweep['grid'])]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs simulation sweeps across several workers over TCP")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help="Serve the jobs of a sweep to workers")
+    serve.add_argument('sweep', help="json file with 'base', 'grid' and 'steps'")
+    serve.add_argument('--state', default="../../out/cluster_state.json")
+    serve.add_argument('--host', default="127.0.0.1")
+    serve.add_argument('--port', type=int, default=5555)
+    serve.add_argument('--lease', type=float, default=30)
+    serve.add_argument('--max-attempts', type=int, default=3)
+
+    work = commands.add_parser('worker', help="Pull jobs from a coordinator and run them")
+    work.add_argument('--host', default="127.0.0.1")
+    work.add_argument('--port', type=int, default=5555)
+
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        coordinator = Coordinator(load_sweep(args.sweep), args.state, args.host, args.port,
+                                  args.lease, args.max_attempts)
+        print(f"serving {len(coordinator.jobs)} jobs on {coordinator.address}")
+        coordinator.serve_until_finished()
+        print(f"finished, state saved to {args.state}")
+    else:
+        run_worker(args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
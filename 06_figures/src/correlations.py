@@ -0,0 +1,161 @@
+import numpy as np
+
+# Temporal correlations and power spectra of the flux through the bin boundaries and of the bin occupancy.
+# Everything is computed with FFTs, so a run of T steps takes O(T log T).
+# The series are (steps, ...) arrays with the steps along the first axis, like bin_crossings and the occupancy,
+# and every other element (boundary, bin, replica) gets its own result.
+#
+# Runs too long to fit in memory are split into segments of segment steps, and the results of the segments are
+# averaged (Welch's method). Only one segment is ever read at a time, so the series can be anything that can be
+# sliced, like a CountArray view or a np.memmap. Without a segment, the whole series is a single segment,
+# which gives the exact correlations.
+
+
+# The neighbouring boundaries (or bins) of a series: element b of a slice is element b + 1 of the series,
+# wrapping around at the end like the periodic domain does
+class Neighbours:
+    def __init__(self, series):
+        self.series = series
+
+    def __len__(self):
+        return len(self.series)
+
+    def __getitem__(self, key):
+        return np.roll(np.asarray(self.series[key]), -1, axis=-1)
+
+
+# Reads the series one segment at a time, as floats with the mean of each segment taken out.
+# Consecutive segments start step steps apart, and a partial segment at the end is left out.
+def segments(series, segment: int, step: int):
+    for start in range(0, len(series) - segment + 1, step):
+        values = np.asarray(series[start:start + segment], dtype=float)
+        yield values - values.mean(axis=0)
+
+
+# The smallest power of 2 that's at least n, which is the length the FFTs are padded to
+def fft_length(n: int) -> int:
+    return 1 << max(int(n) - 1, 0).bit_length()
+
+
+# Sums the cross spectra of a and b, and both of their own spectra, over every segment.
+# The segments are padded to twice their length, so the correlations they give don't wrap around.
+# The spectra are summed rather than averaged, which cancels out once the correlations are normalized.
+def correlation_spectra(a, b, segment: int) -> tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+    n_fft = fft_length(2 * segment)
+    s_ab = s_aa = s_bb = 0
+    count = 0
+
+    # An autocorrelation only needs to read, and take the FFT of, every segment once
+    if b is a:
+        pairs = ((values, values) for values in segments(a, segment, segment))
+    else:
+        pairs = zip(segments(a, segment, segment), segments(b, segment, segment))
+
+    for a_values, b_values in pairs:
+        f_a = np.fft.rfft(a_values, n=n_fft, axis=0)
+        f_b = f_a if b_values is a_values else np.fft.rfft(b_values, n=n_fft, axis=0)
+
+        s_ab = s_ab + np.conj(f_a) * f_b
+        s_aa = s_aa + np.abs(f_a) ** 2
+        s_bb = s_bb + np.abs(f_b) ** 2
+        count += 1
+
+    if count == 0:
+        raise ValueError(f"The series has {len(a)} steps, which is shorter than a segment of {segment}")
+
+    return s_ab, s_aa, s_bb, n_fft
+
+
+# The correlation coefficient between a at time t and b at time t + lag, for lags from -max_lag to max_lag,
+# with shape (2 * max_lag + 1, ...). Every lag is normalized by how many pairs of steps it has.
+def cross_correlation(a, b, max_lag: int = None, segment: int = None) -> np.ndarray:
+    segment = segment or len(a)
+    max_lag = segment // 2 if max_lag is None else min(max_lag, segment - 1)
+
+    s_ab, s_aa, s_bb, n_fft = correlation_spectra(a, b, segment)
+    c_ab = np.fft.irfft(s_ab, n=n_fft, axis=0)
+    variance_a = np.fft.irfft(s_aa, n=n_fft, axis=0)[0] / segment
+    variance_b = np.fft.irfft(s_bb, n=n_fft, axis=0)[0] / segment
+
+    # Negative lags are at the end of the circular result
+    lags = np.arange(-max_lag, max_lag + 1)
+    covariance = c_ab[lags] / (segment - np.abs(lags)).reshape(-1, *[1] * (c_ab.ndim - 1))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return covariance / np.sqrt(variance_a * variance_b)
+
+
+# The autocorrelation of every element of the series, for lags from 0 to max_lag, with shape (max_lag + 1, ...)
+def autocorrelation(series, max_lag: int = None, segment: int = None) -> np.ndarray:
+    correlation = cross_correlation(series, series, max_lag, segment)
+
+    return correlation[len(correlation) // 2:]
+
+
+# The correlation between every boundary (or bin) and the next one over, for lags from -max_lag to max_lag.
+# A positive lag is the next boundary lagging behind this one.
+def neighbour_correlation(series, max_lag: int = None, segment: int = None) -> np.ndarray:
+    return cross_correlation(series, Neighbours(series), max_lag, segment)
+
+
+# The one-sided power spectral density of every element of the series, averaged over segments of segment steps
+# that overlap by the given fraction, each tapered with a Hann window (Welch's method).
+# dt is the time between steps. Returns the frequencies and the spectra, with shape (frequencies, ...).
+def power_spectrum(series, dt: float, segment: int = 256, overlap: float = 0.5) -> tuple[np.ndarray, np.ndarray]:
+    segment = min(segment, len(series))
+    step = max(int(segment * (1 - overlap)), 1)
+
+    window = np.hanning(segment)
+    window = window.reshape(-1, *[1] * (np.ndim(series[0:1]) - 1))
+    scale = dt / np.sum(window ** 2)
+
+    total = 0
+    count = 0
+    for values in segments(series, segment, step):
+        total = total + np.abs(np.fft.rfft(values * window, axis=0)) ** 2
+        count += 1
+
+    spectrum = total * scale / count
+
+    # Every frequency but 0 (and the Nyquist frequency, for an even segment) stands for its negative too
+    last = None if segment % 2 == 1 else -1
+    spectrum[1:last] *= 2
+
+    return np.fft.rfftfreq(segment, dt), spectrum
+
+
+# Averages a result over every element (boundary, bin or replica), leaving only the lag or frequency axis
+def averaged(result: np.ndarray) -> np.ndarray:
+    return np.nanmean(result.reshape(len(result), -1), axis=1)
+
+
+# The same analyses for a simulation (or an ensemble), on its stored crossings and occupancy.
+# The "0th" bin crossing is padding, so the flux starts at the first real step.
+# num_x can be any coarser number of bins that divides the simulation's.
+
+def flux_autocorrelation(sim, max_lag: int = None, segment: int = None, num_x: int = None) -> np.ndarray:
+    return autocorrelation(sim.get_crossings(num_x)[1:], max_lag, segment)
+
+
+def flux_neighbour_correlation(sim, max_lag: int = None, segment: int = None, num_x: int = None) -> np.ndarray:
+    return neighbour_correlation(sim.get_crossings(num_x)[1:], max_lag, segment)
+
+
+def density_autocorrelation(sim, max_lag: int = None, segment: int = None, num_x: int = None) -> np.ndarray:
+    return autocorrelation(sim.get_occupancy(num_x), max_lag, segment)
+
+
+def density_neighbour_correlation(sim, max_lag: int = None, segment: int = None, num_x: int = None) -> np.ndarray:
+    return neighbour_correlation(sim.get_occupancy(num_x), max_lag, segment)
+
+
+# The spectrum of the flux, in (particles per unit time)^2 per unit frequency
+def flux_spectrum(sim, segment: int = 256, overlap: float = 0.5, num_x: int = None) -> tuple[np.ndarray, np.ndarray]:
+    frequencies, spectrum = power_spectrum(sim.get_crossings(num_x)[1:], sim.dt, segment, overlap)
+
+    return frequencies, spectrum / sim.dt ** 2
+
+
+# The spectrum of the particle count in every bin
+def density_spectrum(sim, segment: int = 256, overlap: float = 0.5, num_x: int = None) -> tuple[np.ndarray, np.ndarray]:
+    return power_spectrum(sim.get_occupancy(num_x), sim.dt, segment, overlap)
@@ -0,0 +1,263 @@
+import numpy as np
+
+
+# A compact, growable array of integer counts with one row per simulation step.
+# It is used to store the bin crossings of a simulation without keeping a python list of python ints for every step.
+# Rows live in a preallocated numpy buffer that doubles in size whenever it fills up, so appending a step is
+# amortized O(1), and reading rows or slices back returns views into the buffer instead of copies.
+class CountArray:
+    # The candidate dtypes, from most to least compact
+    DTYPES = (np.int16, np.int32, np.int64)
+
+    # Below this fraction of nonzero entries, the array is saved in the sparse COO layout
+    SPARSE_DENSITY = 0.25
+
+    # row_shape is the shape of a single step, normally just (num_x,)
+    # bound is the largest absolute value we expect to store. It decides the initial dtype.
+    def __init__(self, row_shape, bound: int, capacity: int = 16):
+        self.row_shape = tuple(int(n) for n in np.atleast_1d(row_shape))
+        self.dtype = CountArray.choose_dtype(bound)
+        self.data = np.zeros((max(capacity, 1), *self.row_shape), dtype=self.dtype)
+        self.length = 0
+
+        # The step of the first stored row. It's 0 unless the older rows were dropped.
+        self.first = 0
+
+
+    # Picks the smallest dtype that can hold every value in [-bound, bound]
+    @staticmethod
+    def choose_dtype(bound: int) -> np.dtype:
+        for dtype in CountArray.DTYPES:
+            if abs(bound) <= np.iinfo(dtype).max:
+                return np.dtype(dtype)
+
+        raise OverflowError(f"No integer dtype can hold counts up to {bound}")
+
+
+    # Widens the dtype if the given values don't fit in the current one
+    def ensure_fits(self, values: np.ndarray):
+        if values.size == 0:
+            return
+
+        bound = max(abs(int(values.min())), abs(int(values.max())))
+        if bound > np.iinfo(self.dtype).max:
+            self.dtype = CountArray.choose_dtype(bound)
+            self.data = self.data.astype(self.dtype)
+
+
+    # Makes sure there is space for at least the given number of rows
+    def reserve(self, rows: int):
+        if rows <= len(self.data):
+            return
+
+        capacity = max(rows, 2 * len(self.data))
+        data = np.zeros((capacity, *self.row_shape), dtype=self.dtype)
+        data[:self.length] = self.data[:self.length]
+        self.data = data
+
+
+    # Appends the counts of one step
+    def append(self, row):
+        row = np.asarray(row)
+        self.ensure_fits(row)
+        self.reserve(self.length + 1)
+
+        self.data[self.length] = row
+        self.length += 1
+
+
+    # Appends the counts of several steps at once. rows has shape (steps, *row_shape)
+    def extend(self, rows):
+        rows = np.asarray(rows)
+        self.ensure_fits(rows)
+        self.reserve(self.length + len(rows))
+
+        self.data[self.length:self.length + len(rows)] = rows
+        self.length += len(rows)
+
+
+    # Forgets every stored row, but keeps the buffer for the rows to come.
+    # first moves along, so the steps the next rows belong to are still known.
+    def drop(self):
+        self.first += self.length
+        self.length = 0
+
+
+    # A view of every stored step, with shape (steps, *row_shape). No data is copied.
+    @property
+    def array(self) -> np.ndarray:
+        return self.data[:self.length]
+
+
+    # A view of the counts at a single step
+    def row(self, step: int) -> np.ndarray:
+        return self.array[step]
+
+
+    # The fraction of stored entries that are nonzero
+    def density(self) -> float:
+        if self.length == 0:
+            return 0.0
+
+        return np.count_nonzero(self.array) / self.array.size
+
+
+    # Returns the nonzero entries as flat indices into the (steps, *row_shape) array, along with their values
+    def to_coo(self) -> tuple[np.ndarray, np.ndarray]:
+        flat = self.array.ravel()
+        index = np.flatnonzero(flat)
+
+        return index, flat[index]
+
+
+    # Helper serialization method
+    # Picks the sparse layout automatically when most of the counts are zero
+    def to_dict(self, layout: str = None) -> dict:
+        if layout is None:
+            layout = 'coo' if self.density() < CountArray.SPARSE_DENSITY else 'dense'
+
+        data = {
+            'layout': layout,
+            'dtype': self.dtype.name,
+            'shape': [self.length, *self.row_shape],
+        }
+        if self.first:
+            data['first'] = self.first
+
+        if layout == 'coo':
+            index, values = self.to_coo()
+            data['index'] = index.tolist()
+            data['values'] = values.tolist()
+        elif layout == 'dense':
+            data['values'] = self.array.tolist()
+        else:
+            raise ValueError(f"Unknown layout '{layout}'")
+
+        return data
+
+
+    # Helper deserialization method
+    # Also accepts the plain list of lists that older simulations were saved with
+    @staticmethod
+    def from_dict(data, bound: int = 0) -> 'CountArray':
+        if not isinstance(data, dict):
+            rows = np.asarray(data, dtype=np.int64)
+            counts = CountArray(rows.shape[1:], bound, capacity=len(rows))
+            counts.extend(rows)
+            return counts
+
+        shape = data['shape']
+        counts = CountArray(shape[1:], bound, capacity=shape[0])
+        counts.dtype = np.dtype(data['dtype'])
+        counts.data = np.zeros((max(shape[0], 1), *shape[1:]), dtype=counts.dtype)
+        counts.length = shape[0]
+        counts.first = data.get('first', 0)
+
+        if data['layout'] == 'coo':
+            counts.data.ravel()[np.asarray(data['index'], dtype=np.int64)] = data['values']
+        else:
+            counts.data[:counts.length] = np.asarray(data['values'], dtype=counts.dtype).reshape(shape)
+
+        return counts
+
+
+    def __len__(self):
+        return self.length
+
+
+    def __getitem__(self, key):
+        return self.array[key]
+
+
+    def __iter__(self):
+        return iter(self.array)
+
+
+    # Follows numpy's copy protocol: copy=True always returns a copy, so np.array(counts) can be written to freely,
+    # copy=False never copies (and fails if it would have to), and copy=None only copies to change the dtype
+    def __array__(self, dtype=None, copy=None):
+        needs_conversion = dtype is not None and np.dtype(dtype) != self.dtype
+
+        if copy is False and needs_conversion:
+            raise ValueError(f"Can't convert counts of {self.dtype} to {np.dtype(dtype)} without copying")
+
+        if needs_conversion:
+            return self.array.astype(dtype)
+        if copy:
+            return self.array.copy()
+
+        return self.array
+
+
+# Counts the net number of particles crossing every bin boundary when particles move from old_x to new_x,
+# for a whole array of particles at once.
+# This is the vectorized counterpart of Particle.get_crossings, and follows the same convention:
+# boundary b sits at x = b * L / num_x, and crossing it to the right counts as +1.
+# new_x must not be wrapped back into [0, L) yet, otherwise we can't tell which way the particles went.
+# The particles are along the last axis, and any leading axes (like replicas) are kept,
+# so the result has shape (*old_x.shape[:-1], num_x).
+def count_crossings(old_x: np.ndarray, new_x: np.ndarray, L: float, num_x: int) -> np.ndarray:
+    old_cell = np.floor(old_x / L * num_x).astype(np.int64)
+    new_cell = np.floor(new_x / L * num_x).astype(np.int64)
+
+    # The boundaries crossed are the ones after the leftmost cell, up to and including the rightmost cell
+    first = np.minimum(old_cell, new_cell) + 1
+    number = np.abs(new_cell - old_cell)
+    going_right = new_cell > old_cell
+
+    # Every group of particles gets its own block of num_x counters, so a single bincount handles all of them
+    leading = old_x.shape[:-1]
+    groups = int(np.prod(leading))
+    offsets = np.broadcast_to((np.arange(groups) * num_x).reshape(*leading, 1), old_x.shape)
+
+    counts = np.zeros(groups * num_x, dtype=np.int64)
+
+    # Most particles cross at most one boundary per step, so this loop only runs a handful of times
+    for j in range(int(number.max(initial=0))):
+        crossing = number > j
+        index = (first[crossing] + j) % num_x + offsets[crossing]
+        right = going_right[crossing]
+
+        counts += np.bincount(index[right], minlength=counts.size)
+        counts -= np.bincount(index[~right], minlength=counts.size)
+
+    return counts.reshape(*leading, num_x)
+
+
+# How many cells of a base_num_x grid make up one cell of a coarser num_x grid.
+# Only grids whose cells are whole groups of base cells can be derived, so num_x has to divide base_num_x.
+def coarsening_factor(base_num_x: int, num_x: int) -> int:
+    if num_x <= 0 or base_num_x % num_x != 0:
+        raise ValueError(f"num_x = {num_x} can't be derived from {base_num_x} bins, it has to divide it")
+
+    return base_num_x // num_x
+
+
+# The occupancy on a coarser grid of num_x cells: every cell holds the particles of the base cells it is made of.
+# The cells are along the last axis, and any leading axes (like steps or replicas) are kept.
+def coarsen_occupancy(occupancy, num_x: int) -> np.ndarray:
+    occupancy = np.asarray(occupancy)
+    factor = coarsening_factor(occupancy.shape[-1], num_x)
+    if factor == 1:
+        return occupancy
+
+    return occupancy.reshape(*occupancy.shape[:-1], num_x, factor).sum(axis=-1)
+
+
+# The crossings on a coarser grid of num_x cells.
+# Boundary b of the coarse grid is boundary b * factor of the base grid, so its crossings are just read off;
+# the base boundaries inside a coarse cell are left out.
+def coarsen_crossings(crossings, num_x: int) -> np.ndarray:
+    crossings = np.asarray(crossings)
+    factor = coarsening_factor(crossings.shape[-1], num_x)
+
+    return crossings[..., ::factor]
+
+
+# The crossings summed over consecutive, non-overlapping windows of the given number of steps,
+# with the steps along the first axis. Steps left over at the end, too few to fill a window, are dropped.
+def window_sums(crossings, window: int) -> np.ndarray:
+    crossings = np.asarray(crossings, dtype=np.int64)
+    windows = len(crossings) // window
+
+    return crossings[:windows * window].reshape(windows, window, *crossings.shape[1:]).sum(axis=1)
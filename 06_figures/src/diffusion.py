@@ -0,0 +1,93 @@
+import numpy as np
+
+# The mean squared displacement (MSD) of the particles, and the diffusion coefficient it implies.
+# In one dimension, a Brownian particle has MSD(t) = 2 D t, so fitting a line through the MSD recovers D,
+# which can then be checked against the D the simulation was configured with.
+#
+# The MSD is measured on unwrapped positions (see Simulation.get_unwrapped_positions), since the wrapped ones
+# jump by L whenever a particle goes around the domain. Every lag is averaged over every pair of steps that far
+# apart, using the FFT algorithm of Calandrini et al. (2011), which takes O(T log T) per particle instead of O(T^2),
+# and is done for many particles at once.
+
+
+# The MSD of every particle at every lag from 0 to T - 1, for positions of shape (T, particles).
+# MSD(m) = S1(m) - 2 S2(m), where S2 is the autocorrelation of the positions (found with an FFT)
+# and S1(m) = sum over k < T - m of x(k)^2 + x(k + m)^2, divided by the number of pairs T - m.
+def msd_per_particle(positions: np.ndarray) -> np.ndarray:
+    positions = np.asarray(positions, dtype=float)
+    steps = len(positions)
+    pairs = (steps - np.arange(steps))[:, np.newaxis]
+
+    # Zero padded to twice the length (and on to a power of 2), so the autocorrelation doesn't wrap around
+    n_fft = 1 << (2 * steps - 1).bit_length()
+    f = np.fft.rfft(positions, n=n_fft, axis=0)
+    s2 = np.fft.irfft(np.abs(f) ** 2, n=n_fft, axis=0)[:steps] / pairs
+
+    # The squares of the first T - m positions plus the squares of the last T - m, for every m
+    squares = positions ** 2
+    total = squares.sum(axis=0)
+    head = np.concatenate([np.zeros((1, squares.shape[1])), np.cumsum(squares, axis=0)[:-1]])
+    tail = np.concatenate([np.zeros((1, squares.shape[1])), np.cumsum(squares[::-1], axis=0)[:-1]])
+    s1 = (2 * total - head - tail) / pairs
+
+    return s1 - 2 * s2
+
+
+# The MSDs of the particles, chunk_size particles at a time, which keeps the FFTs (and the memory) small.
+# positions has shape (T, ...), with the steps first and the particles (and replicas) along the other axes.
+def msd_chunks(positions: np.ndarray, chunk_size: int = 1024):
+    positions = np.asarray(positions)
+    positions = positions.reshape(len(positions), -1)
+
+    for start in range(0, positions.shape[1], chunk_size):
+        yield msd_per_particle(positions[:, start:start + chunk_size])
+
+
+# The MSD averaged over every particle, at every lag from 0 to T - 1
+def mean_squared_displacement(positions: np.ndarray, chunk_size: int = 1024) -> np.ndarray:
+    total = 0
+    count = 0
+    for msd in msd_chunks(positions, chunk_size):
+        total = total + msd.sum(axis=1)
+        count += msd.shape[1]
+
+    return total / count
+
+
+# Fits MSD = 2 D t through the origin, for every column of msd, over lags 1 to max_lag.
+# Long lags are averaged over few pairs of steps and are very noisy, so by default only the first quarter is used.
+def fit_diffusion(msd: np.ndarray, dt: float, max_lag: int = None) -> np.ndarray:
+    max_lag = max_lag or max((len(msd) - 1) // 4, 1)
+    t = np.arange(1, max_lag + 1) * dt
+    t = t.reshape(-1, *[1] * (np.ndim(msd) - 1))
+
+    return np.sum(t * msd[1:max_lag + 1], axis=0) / (2 * np.sum(t ** 2))
+
+
+# Measures D from the trajectories of a simulation (or an ensemble) and compares it to the configured D.
+# Every particle gives its own estimate, and since the particles are independent, the spread of those estimates
+# gives the standard error of their mean. z sets the width of the confidence interval (1.96 for 95%).
+# Returns the lags, the MSD at every lag, and a summary of the fit.
+def measure_diffusion(sim, max_lag: int = None, z: float = 1.96, chunk_size: int = 1024) -> tuple[np.ndarray, np.ndarray, dict]:
+    total = 0
+    estimates = []
+    for msd in msd_chunks(sim.get_unwrapped_positions(), chunk_size):
+        total = total + msd.sum(axis=1)
+        estimates.append(fit_diffusion(msd, sim.dt, max_lag))
+
+    estimates = np.concatenate(estimates)
+    msd = total / len(estimates)
+
+    D = float(np.mean(estimates))
+    stderr = float(np.std(estimates, ddof=1) / np.sqrt(len(estimates))) if len(estimates) > 1 else float('nan')
+    interval = (D - z * stderr, D + z * stderr)
+
+    summary = {
+        'D': D,
+        'stderr': stderr,
+        'interval': interval,
+        'configured_D': sim.D,
+        'consistent': bool(interval[0] <= sim.D <= interval[1]),
+    }
+
+    return np.arange(len(msd)) * sim.dt, msd, summary
@@ -0,0 +1,207 @@
+from crossings import CountArray, count_crossings, coarsen_occupancy
+from simulation import Simulation
+from kymograph import Kymograph
+from binned import BinnedStatistics
+import initializers
+import numpy as np
+
+
+# A class representing many independent copies (replicas) of the same simulation.
+# Instead of one Particle object per particle, the positions of every replica are kept in one (R, N) array,
+# and every step is a handful of numpy operations on it. For small N, this is much faster than
+# running the replicas one after the other, since the time is no longer spent in the interpreter.
+class Ensemble(BinnedStatistics):
+
+    # params is the same dictionary a Simulation is made from.
+    # The number of replicas can be given here, or in params as 'replicas'.
+    # If params has a 'seed', the replicas are reproducible.
+    def __init__(self, params: dict, replicas: int = None):
+        self.params = params
+        self.L = params['L']
+        self.num_particles = params['num_particles']
+        self.dt = params['dt']
+        self.D = params['D']
+        self.histogram_config = params['histogram_config']
+        self.replicas = replicas if replicas is not None else params.get('replicas', 1)
+        self.record_history = params.get('record_history', True)
+        self.keep_counts = params.get('keep_counts', True)
+        self.kymograph = None       # Set by enable_kymograph
+
+        self.coefficient = np.sqrt(2 * self.D * self.dt)
+        self.rng = np.random.default_rng(params.get('seed'))
+        self.initial_condition = params.get('initial_condition')
+        if self.initial_condition is None:
+            self.initial_condition = dict(initializers.DEFAULT)
+
+        num_x = self.histogram_config['num_x']
+        self.current_step = 1       # Same as in Simulation, this includes the initial step
+
+        self.x = self.init_positions()
+        self.initial_x = self.x.copy()
+        self.history = [self.x.copy()] if self.record_history else []
+
+        # How many times every particle has gone around the domain, as in Particle.winding.
+        # The wrapped positions plus winding * L are the unwrapped ones, so only an integer is kept per step.
+        self.winding = np.zeros(self.x.shape, dtype=np.int64)
+        self.winding_history = [self.winding.astype(np.int32)] if self.record_history else []
+
+        # The same bookkeeping as a Simulation, with an extra replica axis on every row
+        self.bin_crossings = CountArray((self.replicas, num_x), self.num_particles)
+        self.bin_crossings.append(np.zeros((self.replicas, num_x), dtype=int))
+
+        cells = np.floor(self.x / self.L * num_x).astype(np.int64) % num_x
+        offsets = (np.arange(self.replicas) * num_x)[:, np.newaxis]
+        self.initial_occupancy = np.bincount((cells + offsets).ravel(), minlength=self.replicas * num_x)
+        self.initial_occupancy = self.initial_occupancy.reshape(self.replicas, num_x)
+
+        self.occupancy = self.initial_occupancy.copy()
+        self.occupancy_history = CountArray((self.replicas, num_x), self.num_particles)
+        self.occupancy_history.append(self.occupancy)
+
+        # The moments are kept for every replica separately, so they can be compared or pooled.
+        # The value histograms are pooled over every replica, since they're only ever used that way.
+        self.init_statistics()
+
+
+    # Draws the initial positions of every particle in every replica, as an (R, N) array, from the initial condition.
+    # A 'p_init' callable is still supported, but it's called once per particle.
+    def init_positions(self) -> np.ndarray:
+        shape = (self.replicas, self.num_particles)
+
+        if 'p_init' in self.params.keys():
+            initializer = self.params['p_init']
+            return np.array([initializer() for i in range(self.replicas * self.num_particles)]).reshape(shape) * self.L
+
+        # Explicit positions are the same in every replica
+        if self.initial_condition['type'] == 'array':
+            return np.tile(initializers.sample(self.initial_condition, self.num_particles, self.rng), (self.replicas, 1)) * self.L
+
+        return initializers.sample(self.initial_condition, self.replicas * self.num_particles, self.rng).reshape(shape) * self.L
+
+
+    # Runs one step of every replica
+    def step(self):
+        # One batch of random numbers for every particle of every replica
+        new_x = self.x + self.coefficient * self.rng.standard_normal(self.x.shape)
+
+        crossings = count_crossings(self.x, new_x, self.L, self.histogram_config['num_x'])
+
+        # Since we have a periodic boundary condition, we clamp x to between 0 and L using the modulus
+        self.winding += np.floor(new_x / self.L).astype(np.int64)
+        self.x = new_x % self.L
+        if self.record_history:
+            self.history.append(self.x.copy())
+            self.winding_history.append(self.winding.astype(np.int32))
+
+        self.current_step += 1
+        self.bin_crossings.append(crossings)
+
+        self.occupancy += crossings - np.roll(crossings, -1, axis=-1)
+        self.occupancy_history.append(self.occupancy)
+        self.update_statistics_batch()
+
+        if self.kymograph is not None:
+            self.kymograph.add(self.x)
+
+
+    # Starts binning the positions of every replica into one (time, x) image every step, like Simulation.enable_kymograph
+    def enable_kymograph(self, rows: int = 512, columns: int = 512) -> Kymograph:
+        self.kymograph = Kymograph(self.L, rows, columns, first_step=self.current_step - 1)
+        self.kymograph.add(self.x)
+
+        return self.kymograph
+
+
+    def disable_kymograph(self):
+        self.kymograph = None
+
+
+    # Runs a given number of steps
+    def run_steps(self, steps: int):
+        for i in range(steps):
+            self.step()
+
+
+    # Runs for the given amount of time
+    def run(self, time: float):
+        steps = int(time // self.dt)
+        self.run_steps(steps)
+
+
+    # The positions of every particle at every step, with shape (steps, R, N)
+    # start and stop pick out a range of steps, so a long history can be read a piece at a time.
+    # particles picks out some of the particles by their index in the flattened (R, N) array,
+    # in which case the shape is (steps, len(particles)).
+    def get_positions(self, start: int = None, stop: int = None, particles=None) -> np.ndarray:
+        if not self.record_history:
+            raise ValueError("This ensemble was run with record_history turned off")
+
+        if particles is None:
+            return np.stack(self.history[start:stop])
+
+        return np.stack([x.reshape(-1)[particles] for x in self.history[start:stop]])
+
+
+    # How many times every particle had gone around the domain at every step, with shape (steps, R, N)
+    def get_windings(self, start: int = None, stop: int = None) -> np.ndarray:
+        if not self.record_history:
+            raise ValueError("This ensemble was run with record_history turned off")
+
+        return np.stack(self.winding_history[start:stop])
+
+
+    # The positions of every particle at every step as if the domain didn't wrap around, with shape (steps, R, N)
+    def get_unwrapped_positions(self, start: int = None, stop: int = None) -> np.ndarray:
+        return self.get_positions(start, stop) + self.get_windings(start, stop) * self.L
+
+
+    # Samples the history of every replica num_t times, the same way Simulation.generate_hist does.
+    # Returns histograms of shape (num_t, R, num_x), or (num_t, num_x) if a single replica is asked for,
+    # and the edges of the bins. num_x can be any coarser number of cells that divides the histogram config's.
+    def generate_hist(self, replica: int = None, num_x: int = None) -> tuple[np.ndarray, list]:
+        num_x = num_x or self.histogram_config['num_x']
+        num_t = self.histogram_config['num_t']
+        density = self.histogram_config['number_density']
+
+        dx = self.L / num_x
+
+        t_values = [int(np.floor(t)) for t in np.linspace(0, self.current_step - 1, num_t)]
+        histograms = coarsen_occupancy(self.get_occupancy()[t_values], num_x)
+        if replica is not None:
+            histograms = histograms[:, replica]
+
+        if density:
+            histograms = histograms / dx
+
+        return histograms, [i * dx for i in range(num_x + 1)]
+
+
+    # Turns one replica into a regular Simulation, so it can be plotted, saved and post-processed like any other.
+    def to_simulation(self, replica: int) -> Simulation:
+        params = {key: value for key, value in self.params.items() if key not in ('p_init', 'replicas')}
+        num_x = self.histogram_config['num_x']
+
+        if self.record_history:
+            histories = self.get_positions()[:, replica].T
+            windings = self.get_windings()[:, replica].T
+        else:
+            histories = self.initial_x[replica, :, np.newaxis]
+            windings = np.zeros(histories.shape, dtype=np.int64)
+
+        bin_crossings = CountArray(num_x, self.num_particles, capacity=self.current_step)
+        bin_crossings.extend(self.get_crossings()[:, replica])
+
+        return Simulation.from_dict({
+            **params,
+            'initial_condition': self.initial_condition,
+            'record_history': self.record_history,
+            'current_step': self.current_step,
+            'particles': [
+                {'x': x, 'num_bins': num_x, 'record_history': self.record_history, 'history': history,
+                 'winding': winding, 'windings': particle_windings}
+                for x, history, winding, particle_windings in zip(self.x[replica].tolist(), histories.tolist(),
+                                                                  self.winding[replica].tolist(), windings.tolist())
+            ],
+            'bin_crossings': bin_crossings.to_dict(),
+            'initial_occupancy': self.initial_occupancy[replica],
+        })
@@ -0,0 +1,202 @@
+import os
+
+# The figures are only ever written to files here, so plots has to be imported in headless mode
+os.environ['SIMULATION_HEADLESS'] = '1'
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from collections.abc import Iterator
+from simulation import Simulation
+from atomic import atomic_path
+import functools
+import argparse
+import solutions
+import numpy as np
+
+# A pipeline that renders figures to files on a process pool, without ever opening a window.
+# Every figure is a job, given as a dictionary so that it can be written down in a script or a json file:
+#   {'figure': 'plot_multiple', 'simulations': [paths of saved simulations], 'args': {...},
+#    'output': path without an extension, 'formats': ['png', 'pdf', 'svg']}
+# where figure is one of FIGURES and args are the keyword arguments it takes.
+# Every worker keeps the simulations it loaded and the theory curves it computed, so jobs that share
+# their data don't load or compute it again.
+# Animations can be exported the same way, with their frames split across the workers (see export_frames).
+
+
+# The figures that can be rendered, each drawn from a list of simulations and its keyword arguments
+FIGURES = {
+    'plot_multiple': lambda plots, sims, **args: plots.plot_multiple(sims, **args),
+    'plot_hists_at_steps': lambda plots, sims, **args: plots.plot_hists_at_steps(sims[0], **args),
+    'plot_multiple_hists': lambda plots, sims, **args: plots.plot_multiple_hists(sims, **args),
+}
+
+DEFAULT_FORMATS = ('png',)
+
+# The analytic solutions every simulation gets a cached copy of
+THEORY_FUNCS = ('get_fourier_func', 'get_gaussian_func', 'get_fourier_bound_func', 'get_gaussian_bound_func')
+
+
+# Loads a saved simulation once per worker. The modification time is part of the key,
+# so a file that was rewritten since is loaded again.
+@functools.lru_cache(maxsize=16)
+def load_simulation(path: str, modified: float) -> Simulation:
+    simulation = Simulation.open(path)
+    cache_theory(simulation)
+
+    return simulation
+
+
+def open_simulation(path: str) -> Simulation:
+    return load_simulation(os.path.abspath(path), os.path.getmtime(path))
+
+
+# Replaces the analytic solutions of a simulation with ones that remember every value they computed.
+# The solutions are built once for every truncation n, and evaluated once for every (x, t).
+def cache_theory(simulation: Simulation):
+    for name in THEORY_FUNCS:
+        setattr(simulation, name, cached_theory(getattr(solutions, name), simulation))
+
+
+def cached_theory(make, simulation: Simulation):
+    @functools.lru_cache(maxsize=None)
+    def get(n: int):
+        f = make(simulation, n)
+        table = {}
+
+        def cached(x, t: float):
+            key = (np.asarray(x, dtype=float).tobytes(), t)
+            if key not in table:
+                table[key] = f(x, t)
+
+            return table[key]
+
+        return cached
+
+    return get
+
+
+# Renders one job and writes it in every format it asks for. Returns the paths that were written.
+# Each file is written under a temporary name first, so an interrupted job never leaves a broken figure behind.
+def render_job(job: dict) -> list[str]:
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import plots
+
+    if job['figure'] not in FIGURES:
+        raise ValueError(f"Unknown figure '{job['figure']}', it should be one of {', '.join(FIGURES)}")
+
+    sims = [open_simulation(path) for path in job['simulations']]
+    FIGURES[job['figure']](plots, sims, **job.get('args', {}))
+
+    figure = plt.gcf()
+    os.makedirs(os.path.dirname(os.path.abspath(job['output'])), exist_ok=True)
+
+    paths = []
+    for extension in job.get('formats', DEFAULT_FORMATS):
+        path = f"{job['output']}.{extension}"
+        with atomic_path(path) as temp_path:
+            figure.savefig(temp_path, format=extension)
+        paths.append(path)
+
+    plt.close('all')
+
+    return paths
+
+
+# Renders every job on a process pool, yielding (job, paths) in the order they finish.
+# Jobs that use the same simulations are handed out next to each other, so they tend to land on a worker
+# that already has them loaded.
+def render_figures(jobs: list[dict], workers: int = None) -> Iterator[tuple[dict, list[str]]]:
+    jobs = sorted(jobs, key=lambda job: tuple(job['simulations']))
+
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {pool.submit(render_job, job): job for job in jobs}
+
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+# Renders the given frames of a plot_hists_generated animation to numbered PNGs in out_dir.
+# The figure has a fixed size and resolution and the axes limits are part of the frames,
+# so a frame comes out the same whichever process renders it.
+def render_frames(frames: dict, indices: list[int], out_dir: str, figsize: tuple, dpi: int) -> list[str]:
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import plots
+
+    fig, ax = plt.subplots(figsize=figsize)
+    update = plots.draw_hists_generated(ax, frames)
+
+    paths = []
+    for index in indices:
+        update(index)
+
+        path = frame_path(out_dir, index)
+        fig.savefig(path, dpi=dpi, metadata={'Software': None})
+        paths.append(path)
+
+    plt.close(fig)
+
+    return paths
+
+
+def frame_path(out_dir: str, index: int) -> str:
+    return os.path.join(out_dir, f"frame_{index:05d}.png")
+
+
+# Saves the plot_hists_generated animation of a saved simulation as numbered PNGs in out_dir,
+# splitting the frames into one contiguous block per worker. With workers=1 everything is drawn in this process,
+# which gives exactly the same files. If gif is given, the frames are also put together into an animated GIF there,
+# showing every frame for interval milliseconds. Returns the paths of the frames, in order.
+def export_frames(path: str, out_dir: str, workers: int = None, gif: str = None, interval: int = 500,
+                  figsize: tuple = (6.4, 4.8), dpi: int = 100) -> list[str]:
+    import plots
+
+    frames = plots.hists_generated_frames(open_simulation(path))
+    num_frames = len(frames['hists'])
+    os.makedirs(out_dir, exist_ok=True)
+
+    workers = workers or os.cpu_count() or 1
+    blocks = [block.tolist() for block in np.array_split(np.arange(num_frames), min(workers, num_frames)) if len(block) > 0]
+
+    if workers == 1:
+        paths = render_frames(frames, blocks[0], out_dir, figsize, dpi)
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(render_frames, frames, block, out_dir, figsize, dpi) for block in blocks]
+            paths = [path for future in futures for path in future.result()]
+
+    if gif is not None:
+        # Pillow comes with matplotlib
+        from PIL import Image
+
+        images = [Image.open(frame) for frame in paths]
+        images[0].save(gif, save_all=True, append_images=images[1:], duration=interval, loop=0)
+
+        for image in images:
+            image.close()
+
+    return paths
+
+
+def main(jobs: list[dict]):
+    parser = argparse.ArgumentParser(description="Renders the figures to files, in parallel")
+    parser.add_argument('--workers', type=int, default=None, help="How many processes to render with")
+    parser.add_argument('--formats', nargs='+', default=None, help="Overrides the formats of every figure")
+    parser.add_argument('--animate', metavar='SIMULATION', default=None,
+                        help="Export the histogram animation of this saved simulation as frames, instead of the figures")
+    parser.add_argument('--frames-dir', default="../../out/frames", help="Where the exported frames go")
+    parser.add_argument('--gif', default=None, help="Also put the exported frames together into this GIF")
+    args = parser.parse_args()
+
+    if args.animate:
+        paths = export_frames(args.animate, args.frames_dir, args.workers, args.gif)
+        print(f"{len(paths)} frames written to {args.frames_dir}")
+        return
+
+    if args.formats:
+        jobs = [{**job, 'formats': args.formats} for job in jobs]
+
+    for job, paths in render_figures(jobs, args.workers):
+        print(f"{job['figure']}: {', '.join(paths)}")
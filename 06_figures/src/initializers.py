@@ -0,0 +1,112 @@
+import numpy as np
+
+# Declarative initial conditions for the particles.
+# Unlike a p_init lambda, a spec is a plain dictionary, so it can be written in a config file, saved with the run,
+# and read back by solutions.py to draw the matching theory curves. All positions are fractions of L.
+#
+#   {"type": "delta", "x0": 0.5}                                    every particle starts at x0
+#   {"type": "uniform", "low": 0, "high": 1}                        uniform between low and high (default: everywhere)
+#   {"type": "normal", "mu": 0.5, "sigma": 0.01}                    normal distribution, wrapped around the domain
+#   {"type": "piecewise", "edges": [0, 0.5, 1], "density": [3, 1]}  constant density on every segment between edges
+#   {"type": "array", "positions": [0.1, 0.2, ...]}                 explicit positions, one per particle
+
+TYPES = ('delta', 'uniform', 'normal', 'piecewise', 'array')
+
+# What the simulation used before initial conditions could be specified
+DEFAULT = {'type': 'uniform'}
+
+
+def check(spec: dict):
+    if spec.get('type') not in TYPES:
+        raise ValueError(f"Unknown initial condition type '{spec.get('type')}', expected one of {TYPES}")
+
+
+# Draws the initial positions of n particles at once, as fractions of L in [0, 1)
+def sample(spec: dict, n: int, rng: np.random.Generator) -> np.ndarray:
+    check(spec)
+    kind = spec['type']
+
+    if kind == 'delta':
+        return np.full(n, float(spec['x0']))
+
+    if kind == 'uniform':
+        low, high = spec.get('low', 0.0), spec.get('high', 1.0)
+        # rng.random is kept for the default, so seeded runs match the per-particle initializer they replace
+        return rng.random(n) * (high - low) + low
+
+    if kind == 'normal':
+        return rng.normal(spec['mu'], spec['sigma'], n) % 1.0
+
+    if kind == 'piecewise':
+        edges = np.asarray(spec['edges'], dtype=float)
+        weights = np.asarray(spec['density'], dtype=float) * np.diff(edges)
+
+        # Pick a segment for every particle in proportion to its mass, then a uniform position inside of it
+        segments = rng.choice(len(weights), size=n, p=weights / weights.sum())
+        return edges[segments] + rng.random(n) * np.diff(edges)[segments]
+
+    positions = np.asarray(spec['positions'], dtype=float)
+    if len(positions) != n:
+        raise ValueError(f"The initial condition has {len(positions)} positions, but there are {n} particles")
+
+    return positions % 1.0
+
+
+# The Fourier coefficients of the initial distribution, E[exp(-2 pi i k X)] for every wavenumber k,
+# where X is the initial position as a fraction of L.
+# These are all the analytic solutions need: every mode decays on its own as the particles diffuse.
+def fourier_coefficients(spec: dict, k: np.ndarray) -> np.ndarray:
+    check(spec)
+    kind = spec['type']
+    k = np.asarray(k, dtype=float)
+
+    if kind == 'delta':
+        return np.exp(-2j * np.pi * k * spec['x0'])
+
+    if kind == 'uniform':
+        return segment_coefficients(spec.get('low', 0.0), spec.get('high', 1.0), k)
+
+    if kind == 'normal':
+        return np.exp(-2j * np.pi * k * spec['mu'] - 2 * (np.pi * k * spec['sigma']) ** 2)
+
+    if kind == 'piecewise':
+        edges = np.asarray(spec['edges'], dtype=float)
+        weights = np.asarray(spec['density'], dtype=float) * np.diff(edges)
+        weights = weights / weights.sum()
+
+        return sum(w * segment_coefficients(a, b, k) for w, a, b in zip(weights, edges[:-1], edges[1:]))
+
+    positions = np.asarray(spec['positions'], dtype=float)
+    return np.mean(np.exp(-2j * np.pi * np.multiply.outer(k, positions)), axis=-1)
+
+
+# The Fourier coefficients of a uniform distribution between a and b
+def segment_coefficients(a: float, b: float, k: np.ndarray) -> np.ndarray:
+    if b <= a:
+        return np.exp(-2j * np.pi * k * a)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        coefficients = (np.exp(-2j * np.pi * k * a) - np.exp(-2j * np.pi * k * b)) / (2j * np.pi * k * (b - a))
+
+    return np.where(k == 0, 1, coefficients)
+
+
+# Describes the initial distribution as a mixture of normal distributions, as (weights, means, variances),
+# with means and variances as fractions of L. Point masses have a variance of 0.
+# This is what the Gaussian (method of images) solutions need. It returns None for distributions
+# that aren't a mixture of normals (uniform and piecewise).
+def gaussian_components(spec: dict):
+    check(spec)
+    kind = spec['type']
+
+    if kind == 'delta':
+        return np.ones(1), np.array([float(spec['x0'])]), np.zeros(1)
+
+    if kind == 'normal':
+        return np.ones(1), np.array([float(spec['mu'])]), np.array([float(spec['sigma']) ** 2])
+
+    if kind == 'array':
+        positions = np.asarray(spec['positions'], dtype=float) % 1.0
+        return np.full(len(positions), 1 / len(positions)), positions, np.zeros(len(positions))
+
+    return None
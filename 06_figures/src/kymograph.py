@@ -0,0 +1,115 @@
+import numpy as np
+
+
+# A (time, x) image of where the particles have been: every row covers a block of steps, every column a cell of
+# the domain, and every pixel counts how many particle positions fell in it.
+# When there are too many particles for their paths to mean anything, this is what gets plotted instead.
+# The image never grows: once every row is full, neighbouring rows are merged in pairs and every row
+# covers twice as many steps as before, so the memory is bounded by rows * columns however long the run is.
+class Kymograph:
+
+    # L is the size of the domain. rows must be even, so that the rows can always be merged in pairs.
+    # first_step is the step of the first positions that will be added.
+    def __init__(self, L: float, rows: int = 512, columns: int = 512, first_step: int = 0):
+        if rows < 2 or rows % 2 != 0:
+            raise ValueError(f"The number of rows must be even and at least 2, not {rows}")
+
+        self.L = L
+        self.rows = rows
+        self.columns = columns
+        self.first_step = first_step
+
+        self.counts = np.zeros((rows, columns), dtype=np.int64)
+        self.steps_per_row = 1
+        self.steps = 0          # How many steps have been added so far
+
+
+    # Adds the positions of every particle at a single step, in any shape (like the (R, N) positions of an Ensemble)
+    def add(self, positions):
+        positions = np.asarray(positions, dtype=float).ravel()
+
+        while self.steps >= self.rows * self.steps_per_row:
+            self.coarsen()
+
+        row = self.steps // self.steps_per_row
+        self.counts[row] += np.bincount(self.cells(positions), minlength=self.columns)
+        self.steps += 1
+
+
+    # Adds the positions at several consecutive steps at once, given as a (steps, ...) array
+    def add_steps(self, positions):
+        positions = np.asarray(positions, dtype=float)
+        positions = positions.reshape(len(positions), -1)
+        if len(positions) == 0:
+            return
+
+        while self.steps + len(positions) > self.rows * self.steps_per_row:
+            self.coarsen()
+
+        rows = (self.steps + np.arange(len(positions))) // self.steps_per_row
+        first, last = rows[0], rows[-1]
+
+        # Only the rows these steps land in are counted into, so the temporary array stays small
+        index = (rows - first)[:, np.newaxis] * self.columns + self.cells(positions)
+        touched = last - first + 1
+        self.counts[first:last + 1] += np.bincount(index.ravel(), minlength=touched * self.columns).reshape(touched, self.columns)
+
+        self.steps += len(positions)
+
+
+    # The column every position falls in, binned the same way as the histograms
+    def cells(self, positions: np.ndarray) -> np.ndarray:
+        return np.floor(positions / self.L * self.columns).astype(np.int64) % self.columns
+
+
+    # Halves the time resolution, making room for as many steps again
+    def coarsen(self):
+        merged = self.counts.reshape(self.rows // 2, 2, self.columns).sum(axis=1)
+
+        self.counts = np.zeros_like(self.counts)
+        self.counts[:self.rows // 2] = merged
+        self.steps_per_row *= 2
+
+
+    # How many rows have anything in them
+    @property
+    def filled(self) -> int:
+        return -(-self.steps // self.steps_per_row)
+
+
+    # The first step of every filled row, and the step after the last one, so there are filled + 1 of them
+    def step_edges(self) -> np.ndarray:
+        edges = self.first_step + np.arange(self.filled + 1) * self.steps_per_row
+        edges[-1] = self.first_step + self.steps
+
+        return edges
+
+
+    # The average number density in every pixel of the filled rows, with shape (filled, columns).
+    # replicas is how many copies of the system went into the image, so that the density is that of a single one.
+    def density(self, replicas: int = 1) -> np.ndarray:
+        steps_in_row = np.diff(self.step_edges())
+        dx = self.L / self.columns
+
+        return self.counts[:self.filled] / (steps_in_row[:, np.newaxis] * dx * replicas)
+
+
+    # Builds the image from a simulation's (or an ensemble's) stored history,
+    # reading chunk_size steps at a time so only that much of the history is ever copied at once.
+    # The number of steps is known in advance here, so the rows are sized to cover all of them without merging.
+    @staticmethod
+    def from_history(simulation, rows: int = 512, columns: int = 512, chunk_size: int = None) -> 'Kymograph':
+        steps = simulation.current_step
+        particles = simulation.num_particles * getattr(simulation, 'replicas', 1)
+
+        kymograph = Kymograph(simulation.L, rows, columns)
+        kymograph.steps_per_row = max(-(-steps // rows), 1)
+
+        # About a million positions per chunk
+        if chunk_size is None:
+            chunk_size = max(2 ** 20 // max(particles, 1), 1)
+
+        for start in range(0, steps, chunk_size):
+            kymograph.add_steps(simulation.get_positions(start, start + chunk_size))
+
+        return kymograph
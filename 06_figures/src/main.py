@@ -1,9 +1,7 @@
-import numpy as np
-import plots
-from simulation import Simulation
+from sweep import run_sweep
 import json
 import os
-from post_process import *
+import shutil
 
 config_path = "../configs/config_0.json"
 out_path = "../../out/sim3"
@@ -33,33 +31,28 @@ def main():
         print(f"An error occurred: {e}")
 
 
-    for i in range(1, 4):
-        config1 = load_config(f"../configs/config1-{i}.json")
-        sim1 = Simulation(config1)
+    # The runs are cached, so only the configs that changed since last time are recomputed
+    configs = [load_config(f"../configs/config1-{i}.json") for i in range(1, 4)]
+    for config, path, cached in run_sweep(configs, 200):
+        i = configs.index(config) + 1
+        print(f"config1-{i}: {'cached' if cached else 'computed'}")
 
-        sim1.run_steps(200)
+        shutil.copyfile(path, f"../../out/sim6-1-{i}.json")
 
-        sim1.save_to(f"../../out/sim6-1-{i}.json", as_json=True)
 
+    # The runs that start from a delta. They need their initial condition on record for the theory curves,
+    # so files saved before it was recorded are replaced by these.
+    for name, steps in (("2", 200), ("3", 500)):
+        config = load_config(f"../configs/config{name}.json")
+        for _, path, cached in run_sweep([config], steps):
+            print(f"config{name}: {'cached' if cached else 'computed'}")
 
-    # config2 = load_config("../configs/config2.json")
-    # config2['p_init'] = lambda: 0.5
-    # sim2 = Simulation(config2)
-#
-    # sim2.run_steps(200)
-#
-    # sim2.save_to("../../out/sim6-2.json", as_json=True)
-#
-#
-    # config3 = load_config("../configs/config3.json")
-    # config3['p_init'] = lambda: 0.5
-    # sim3 = Simulation(config3)
-#
-    # sim3.run_steps(500)
-#
-    # sim3.save_to("../../out/sim6-3.json", as_json=True)
+            shutil.copyfile(path, f"../../out/sim6-{name}.json")
 
 
 if __name__ == "__main__":
     main()
+
+    # Only imported now, since plotting is slow to import and isn't needed to run the simulations
+    from post_process import plot_graphs
     plot_graphs()
\ No newline at end of file
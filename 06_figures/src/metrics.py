@@ -0,0 +1,167 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import deque
+from atomic import atomic_path
+import threading
+import resource
+import json
+import time
+import os
+
+# Live metrics for long simulation runs, so we can tell whether a run is healthy without attaching a debugger.
+# Pass a RunMetrics to Simulation.run_steps, and it will publish rolling throughput and memory numbers
+# to its sinks every few seconds. A sink is anything with a publish(metrics: dict) method.
+
+
+# The resident memory of this process, in bytes
+def get_rss() -> int:
+    try:
+        with open("/proc/self/statm", 'r') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # Not on Linux, so fall back to the peak instead
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# How much memory the recorded history of a simulation takes up.
+# Every entry of a particle's history is a python float (24 bytes) plus its pointer in the list (8 bytes),
+# and the pointer to its winding number (8 bytes), which is almost always one of python's cached small ints.
+def get_history_bytes(simulation) -> int:
+    total = simulation.bin_crossings.data.nbytes + simulation.occupancy_history.data.nbytes
+
+    if simulation.record_history:
+        total += simulation.num_particles * simulation.current_step * 40
+
+    return total
+
+
+class RunMetrics:
+    # sinks are where the metrics are published to
+    # interval is the least time between two publications, in seconds, which keeps the overhead negligible
+    # window is how many publications the rolling throughput is averaged over
+    def __init__(self, sinks: list, interval: float = 2.0, window: int = 10):
+        self.sinks = sinks
+        self.interval = interval
+        self.samples = deque(maxlen=window + 1)     # (time, step) pairs
+        self.target_step = None
+        self.last_publish = 0.0
+
+
+    # Called by run_steps before it starts
+    def start(self, simulation, steps: int):
+        self.target_step = simulation.current_step + steps
+        self.samples.clear()
+        self.samples.append((time.perf_counter(), simulation.current_step))
+        self.last_publish = self.samples[0][0]
+
+
+    # Called by run_steps after every step. Only does any work once per interval.
+    def update(self, simulation):
+        now = time.perf_counter()
+        if now - self.last_publish >= self.interval:
+            self.publish(simulation, now)
+
+
+    # Called by run_steps once it's done, so the sinks always see the final state
+    def finish(self, simulation):
+        self.publish(simulation, time.perf_counter())
+
+
+    def publish(self, simulation, now: float):
+        self.samples.append((now, simulation.current_step))
+        self.last_publish = now
+
+        metrics = self.compute(simulation)
+        for sink in self.sinks:
+            sink.publish(metrics)
+
+
+    def compute(self, simulation) -> dict:
+        (first_time, first_step), (last_time, last_step) = self.samples[0], self.samples[-1]
+        elapsed = last_time - first_time
+        steps_per_second = (last_step - first_step) / elapsed if elapsed > 0 else 0.0
+
+        remaining = self.target_step - simulation.current_step
+        eta = remaining / steps_per_second if steps_per_second > 0 else None
+
+        return {
+            'time': time.time(),
+            'step': simulation.current_step,
+            'target_step': self.target_step,
+            'steps_per_second': steps_per_second,
+            'particle_steps_per_second': steps_per_second * simulation.num_particles,
+            'eta_seconds': eta,
+            'history_bytes': get_history_bytes(simulation),
+            'rss_bytes': get_rss(),
+            'checkpoint_lag_steps': simulation.current_step - simulation.saved_step,
+        }
+
+
+# Rewrites a json file with the latest metrics, through a temporary file so readers never see half of it
+class JsonStatusSink:
+    def __init__(self, path: str):
+        self.path = path
+
+
+    def publish(self, metrics: dict):
+        with atomic_path(self.path) as temp_path:
+            with open(temp_path, 'w') as file:
+                json.dump(metrics, file, indent=2)
+
+
+# Serves the latest metrics over HTTP in the Prometheus text format, at /metrics
+class PrometheusSink:
+    # The metrics worth exporting, with their help text
+    METRICS = {
+        'step': "Number of steps computed, including the initial step",
+        'target_step': "Step the current run will stop at",
+        'steps_per_second': "Rolling simulation steps per second",
+        'particle_steps_per_second': "Rolling particle steps per second",
+        'eta_seconds': "Estimated time until the run is done",
+        'history_bytes': "Memory used by the recorded history",
+        'rss_bytes': "Resident memory of the process",
+        'checkpoint_lag_steps': "Steps computed since the simulation was last saved",
+    }
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 9464, prefix: str = "simulation_"):
+        self.prefix = prefix
+        self.text = ""
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = sink.text.encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            # Keeps the console quiet
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.address = self.server.server_address
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+    def publish(self, metrics: dict):
+        s = ""
+        for name, help_text in PrometheusSink.METRICS.items():
+            if metrics.get(name) is None:
+                continue
+
+            s += f"# HELP {self.prefix}{name} {help_text}\n"
+            s += f"# TYPE {self.prefix}{name} gauge\n"
+            s += f"{self.prefix}{name} {metrics[name]}\n"
+
+        self.text = s
+
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
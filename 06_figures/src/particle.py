@@ -4,13 +4,22 @@ import math
 
 class Particle:
     # We can initialize a particle with some initial conditions
-    def __init__(self, x_i: float, num_bins: int):
+    # If record_history is False, only the initial position is kept, which is enough for histogram-only runs
+    def __init__(self, x_i: float, num_bins: int, record_history: bool = True):
         self.x = x_i
         self.num_bins = num_bins
+        self.record_history = record_history
         self.history = []       # Used to store information about the particle's past position
 
+        # How many times the particle has gone around the domain, counting +1 for every time it wraps past L
+        # and -1 for every time it wraps past 0. Together with the wrapped positions in history,
+        # this gives the unwrapped position: history[i] + windings[i] * L.
+        self.winding = 0
+        self.windings = []
+
         # Record the initial position
         self.history.append(self.x)
+        self.windings.append(self.winding)
 
     # Computes which bin boundaries are crossed during an update
     # As well as what direction
@@ -30,33 +39,48 @@ class Particle:
         # By scaling the x positions by num_bins / L, we scale the boundaries of our cells to lie on the integers
         # So now, we can see which boundaries are crossed by simply seeing which integers lie between
         # the x positions before and after the crossing
-        # We can do this by ceiling both numbers and using python's range function.
-        crossings = range(math.ceil(leftmost / L * self.num_bins), math.ceil(rightmost / L * self.num_bins))
+        # Flooring both numbers gives the cell each position is in, so the crossed boundaries are the ones
+        # after the leftmost cell, up to and including the rightmost cell.
+        # This keeps the crossings consistent with the histograms, even for particles sitting exactly on a boundary.
+        crossings = range(math.floor(leftmost / L * self.num_bins) + 1, math.floor(rightmost / L * self.num_bins) + 1)
 
         return going_right, [crossing % self.num_bins for crossing in crossings]
 
 
     # Updates the position of the particle for one timestep dt.
     # The coefficient C is sqrt(2 * D * dt) and its computation is handled by the Simulation class
-    def update(self, L: float, C: float) -> tuple[bool, list]:
-        dx = C * np.random.normal(0, 1)
+    # rng is where the random steps come from, so that simulations can be seeded
+    def update(self, L: float, C: float, rng=np.random) -> tuple[bool, list]:
+        return self.move(L, C * rng.normal(0, 1))
+
+
+    # Moves the particle by a displacement that was already drawn.
+    # The Simulation class draws the displacements of every particle at once, which is much faster.
+    def move(self, L: float, dx: float) -> tuple[bool, list]:
         old_x = self.x
         self.x += dx
 
         crossing_data = self.get_crossings(L, old_x)
 
-        # Since we have a periodic boundary condition, we clamp x
-        # to between 0 and L using the modulus
-        self.x = self.x % L
-
-        # This is how we record the movement of the particle
-        self.history.append(self.x)
+        self.wrap(L)
 
         # The data about the boundary crossings is given to the parent simulation object, who ends up
         # counting how many crossings happen every update.
         return crossing_data
 
 
+    # Since we have a periodic boundary condition, we clamp x
+    # to between 0 and L using the modulus, and then record the new position
+    def wrap(self, L: float):
+        self.winding += math.floor(self.x / L)
+        self.x = self.x % L
+
+        # This is how we record the movement of the particle
+        if self.record_history:
+            self.history.append(self.x)
+            self.windings.append(self.winding)
+
+
     # Helper serialization method
     def to_json(self) -> str:
         return json.dumps(self, default=lambda o: o.__dict__)
@@ -65,7 +89,12 @@ class Particle:
     # Helper deserialization method
     @staticmethod
     def from_json(json_data: dict) -> 'Particle':
-        particle = Particle(json_data['x'], json_data['num_bins'])
+        particle = Particle(json_data['x'], json_data['num_bins'], json_data.get('record_history', True))
         particle.history = json_data['history']
 
+        # Older files don't have the winding numbers. They're left empty here, and filled in by the simulation,
+        # which knows L (see Simulation.from_dict).
+        particle.winding = json_data.get('winding', 0)
+        particle.windings = json_data.get('windings', [])
+
         return particle
\ No newline at end of file
@@ -0,0 +1,251 @@
+from crossings import CountArray
+from binned import STATISTICS_BATCH
+from simulation import Simulation
+from ensemble import Ensemble
+from atomic import atomic_path
+import numpy as np
+import copy
+import json
+import re
+
+# Predicts how much memory a run will need before any work starts, and picks a setup that fits a memory budget.
+# The costs below were measured with tracemalloc on the current engines, and are per particle per step
+# unless stated otherwise.
+
+PARTICLE_BYTES = 240            # A Particle object, its __dict__ and its history list
+HISTORY_BYTES = 40              # A python float in a particle's history (24 bytes), its pointer (8 bytes)
+                                # and the pointer to its winding number (8 bytes, the small ints are cached)
+SERIALIZE_BYTES = 40            # to_json holds the encoder's chunks and the final string at the same time
+ENSEMBLE_STEP_BYTES = 56        # The temporary arrays of one Ensemble step, per particle
+ENSEMBLE_HISTORY_BYTES = 12     # A float64 position and an int32 winding number in an Ensemble's history
+BASE_BYTES = 64 * 1024 ** 2     # The interpreter, numpy and the rest of the process
+FLUSH_BYTES = 32                # The temporary arrays of a batch of statistics, per count in the batch
+
+ENGINES = ('simulation', 'ensemble')
+# Whether the particle positions are recorded, only the counts the histograms are drawn from,
+# or only the streaming statistics (see keep_counts in binned.py), from most to least memory
+POLICIES = ('full', 'histograms', 'statistics')
+
+
+# Reads a memory budget like "512MB" or "4 GiB" into a number of bytes
+def parse_budget(budget) -> int:
+    if isinstance(budget, (int, float)):
+        return int(budget)
+
+    match = re.fullmatch(r"\s*([\d.]+)\s*([kmgt]?)i?b?\s*", budget.lower())
+    if match is None:
+        raise ValueError(f"Can't read the memory budget '{budget}'")
+
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** " kmgt".index(unit or " "))
+
+
+# Predicts the memory of each part of a run, in bytes, along with the peak.
+# The count arrays double their capacity as they grow, so they are counted at twice their size.
+def estimate_memory(config: dict, steps: int, engine: str = 'simulation', policy: str = 'full',
+                    replicas: int = 1, save: bool = True) -> dict:
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine '{engine}'")
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown recording policy '{policy}'")
+
+    num_particles = config['num_particles']
+    num_x = config['histogram_config']['num_x']
+    records = steps + 1     # Including the initial step
+    replicas = replicas if engine == 'ensemble' else 1
+    particles = num_particles * replicas
+
+    # The crossings and the occupancy. Without keep_counts, only about a batch of rows is ever stored.
+    itemsize = CountArray.choose_dtype(num_particles).itemsize
+    stored = records if policy != 'statistics' else min(records, max(STATISTICS_BATCH // (replicas * num_x), 1) + 1)
+    estimate = {
+        'base': BASE_BYTES,
+        'counts': 2 * 2 * stored * replicas * num_x * itemsize,
+        'statistics': 6 * replicas * num_x * 8 + min(records * replicas * num_x, STATISTICS_BATCH) * FLUSH_BYTES,
+    }
+
+    if engine == 'simulation':
+        estimate['particles'] = num_particles * PARTICLE_BYTES
+        estimate['history'] = num_particles * records * HISTORY_BYTES if policy == 'full' else 0
+        estimate['step'] = num_particles * 8 + num_x * 8
+
+        # Saving only happens between steps, so it adds to the history instead of the step
+        estimate['serialization'] = 0
+        if save:
+            estimate['serialization'] = num_particles * (records if policy == 'full' else 1) * SERIALIZE_BYTES
+    else:
+        estimate['particles'] = 2 * particles * 8       # The current and initial positions
+        estimate['history'] = particles * records * ENSEMBLE_HISTORY_BYTES if policy == 'full' else 0
+        estimate['step'] = particles * ENSEMBLE_STEP_BYTES
+        estimate['serialization'] = 0
+
+    resident = estimate['base'] + estimate['counts'] + estimate['statistics'] + estimate['particles'] + estimate['history']
+    estimate['peak'] = resident + max(estimate['step'], estimate['serialization'])
+
+    return estimate
+
+
+# Picks how many steps to run between checkpoints.
+# A block should add at most a twentieth of the remaining headroom, so a checkpoint never comes too late.
+def choose_block_steps(config: dict, steps: int, engine: str, policy: str, replicas: int, headroom: int) -> int:
+    one_step = estimate_memory(config, 1, engine, policy, replicas, save=False)
+    no_step = estimate_memory(config, 0, engine, policy, replicas, save=False)
+    growth = max(one_step['peak'] - no_step['peak'], 1)
+
+    return int(np.clip(headroom // 20 // growth, 1, max(steps, 1)))
+
+
+# Works out a setup for running config for the given number of steps within budget bytes of memory.
+# The engine and policy given are tried first. If they don't fit and downgrading is allowed, the recording is
+# reduced to histograms only, then to the streaming statistics only, and ensembles are split into chunks
+# of fewer replicas that are run one after another. Ensembles are always planned with the statistics policy.
+# Raises a MemoryError if nothing fits, before any work is done.
+def plan_run(config: dict, steps: int, budget, engine: str = 'simulation', policy: str = 'full',
+             replicas: int = None, save: bool = True, allow_downgrade: bool = True) -> dict:
+    budget = parse_budget(budget)
+    replicas = replicas if replicas is not None else config.get('replicas', 1)
+
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown recording policy '{policy}'")
+
+    # An ensemble is only ever kept as its pooled statistics (see run_planned), so nothing else is worth recording
+    if engine == 'ensemble':
+        policy = 'statistics'
+    policies = list(POLICIES[POLICIES.index(policy):]) if allow_downgrade else [policy]
+    tried = []
+
+    for candidate in policies:
+        chunk = replicas
+        while True:
+            estimate = estimate_memory(config, steps, engine, candidate, chunk, save)
+            tried.append((candidate, chunk, estimate['peak']))
+
+            if estimate['peak'] <= budget:
+                adjusted = dict(config, record_history=(candidate == 'full'), keep_counts=(candidate != 'statistics'))
+                if engine == 'ensemble':
+                    adjusted['replicas'] = chunk
+
+                return {
+                    'engine': engine,
+                    'policy': candidate,
+                    'replicas': replicas,
+                    'chunk_replicas': chunk,
+                    'chunks': -(-replicas // chunk),
+                    'block_steps': choose_block_steps(config, steps, engine, candidate, chunk, budget - estimate['peak']),
+                    'estimate': estimate,
+                    'budget': budget,
+                    'downgraded': candidate != policy or chunk != replicas,
+                    'config': adjusted,
+                }
+
+            # Only an ensemble can be split up, and only if we're allowed to
+            if engine != 'ensemble' or not allow_downgrade or chunk == 1:
+                break
+            chunk = max(chunk // 2, 1)
+
+    attempts = ", ".join(f"{p} x{r}: {peak / 1024 ** 2:.0f} MB" for p, r, peak in tried)
+    raise MemoryError(f"No setup fits in {budget / 1024 ** 2:.0f} MB ({attempts})")
+
+
+# The statistics of an ensemble in raw counts, pooled over its replicas so that chunks of any size can be merged:
+# the per-bin moments of the occupancy, the per-boundary moments of the crossings summed over every window
+# of the flux pyramid, and the value histograms.
+def pooled_statistics(ensemble: Ensemble) -> dict:
+    pyramid = ensemble.flux_pyramid
+
+    return {
+        'occupancy_moments': ensemble.occupancy_moments.pooled(axis=0),
+        'flux_moments': {window: pyramid.moments(window).pooled(axis=0) for window in pyramid.windows},
+        'occupancy_histogram': ensemble.occupancy_histogram,
+        'crossing_histogram': ensemble.crossing_histogram,
+    }
+
+
+# Merges the pooled statistics of another chunk into totals, which is None before the first one.
+# A chunk that's only partly run may not have reached the longest windows yet, and simply adds nothing to them.
+def merge_statistics(totals: dict, statistics: dict) -> dict:
+    if totals is None:
+        return statistics
+
+    totals['occupancy_moments'].merge(statistics['occupancy_moments'])
+    for window, moments in statistics['flux_moments'].items():
+        if window in totals['flux_moments']:
+            totals['flux_moments'][window].merge(moments)
+        else:
+            totals['flux_moments'][window] = moments
+    totals['occupancy_histogram'].merge(statistics['occupancy_histogram'])
+    totals['crossing_histogram'].merge(statistics['crossing_histogram'])
+
+    return totals
+
+
+def statistics_to_dict(statistics: dict) -> dict:
+    return {
+        'occupancy_moments': statistics['occupancy_moments'].to_dict(),
+        'flux_moments': {str(window): moments.to_dict() for window, moments in statistics['flux_moments'].items()},
+        'occupancy_histogram': statistics['occupancy_histogram'].to_dict(),
+        'crossing_histogram': statistics['crossing_histogram'].to_dict(),
+    }
+
+
+# Runs a plan made by plan_run.
+# Both engines are run block_steps at a time, and if save_to is given, the progress is saved there after every block,
+# so a run that dies partway only loses the last block.
+# A simulation is returned as is. Metrics are only published for a simulation.
+# An ensemble is run a chunk at a time, and every chunk is reduced to its pooled statistics (see pooled_statistics)
+# and merged with the ones before it, so only one chunk is ever alive. Those merged statistics are returned,
+# and are what's saved for an ensemble, along with how far the run got.
+def run_planned(plan: dict, steps: int, metrics=None, save_to: str = None):
+    if plan['engine'] == 'simulation':
+        simulation = Simulation(plan['config'])
+        if metrics is not None:
+            metrics.start(simulation, steps)
+
+        for start in range(0, steps, plan['block_steps']):
+            for i in range(min(plan['block_steps'], steps - start)):
+                simulation.step()
+                if metrics is not None:
+                    metrics.update(simulation)
+
+            if save_to is not None:
+                # Through a temporary file, so an interrupted save never leaves a broken checkpoint behind
+                with atomic_path(save_to) as temp_path:
+                    simulation.save_to(temp_path)
+
+        if metrics is not None:
+            metrics.finish(simulation)
+
+        return simulation
+
+    totals = None
+    remaining = plan['replicas']
+    for i in range(plan['chunks']):
+        config = dict(plan['config'])
+        if config.get('seed') is not None:
+            config['seed'] = [config['seed'], i]    # Every chunk needs its own random numbers
+
+        ensemble = Ensemble(config, min(plan['chunk_replicas'], remaining))
+        for start in range(0, steps, plan['block_steps']):
+            ensemble.run_steps(min(plan['block_steps'], steps - start))
+
+            if save_to is not None:
+                # The chunk so far is merged into a copy, since the totals mustn't count it twice once it's done
+                progress = merge_statistics(copy.deepcopy(totals), pooled_statistics(ensemble))
+                checkpoint = {
+                    'steps': steps,
+                    'replicas': plan['replicas'],
+                    'finished_chunks': i,
+                    'chunk_steps': ensemble.current_step - 1,
+                    'statistics': statistics_to_dict(progress),
+                }
+                with atomic_path(save_to) as temp_path:
+                    with open(temp_path, 'w') as file:
+                        json.dump(checkpoint, file)
+
+        totals = merge_statistics(totals, pooled_statistics(ensemble))
+        remaining -= ensemble.replicas
+
+        # Let go of the chunk before the next one is made
+        del ensemble
+
+    return totals
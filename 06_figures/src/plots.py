@@ -1,23 +1,116 @@
+import matplotlib
+import os
+
+# In headless mode (SIMULATION_HEADLESS=1), figures are only ever rendered to files, and never shown.
+# This has to be decided before pyplot is imported.
+HEADLESS = os.environ.get('SIMULATION_HEADLESS') == '1'
+if HEADLESS:
+    matplotlib.use('Agg')
+
 import matplotlib.pyplot as plt
 from matplotlib.axes import Axes
-import matplotlib.animation as animation
 from matplotlib import colors
+from matplotlib.collections import LineCollection
 from simulation import Simulation
-import numpy as np
-from functools import reduce
-import scipy.stats as stats
+from accumulators import expected_density_stats, expected_flux_stats
+import trajectories
+from kymograph import Kymograph
 import solutions
+import numpy as np
+
+# matplotlib.animation and scipy.stats are slow to import and only a few plots need them,
+# so they are imported inside those functions.
+
+
+# Shows the current figures, unless we're running headless
+def show():
+    if not HEADLESS:
+        plt.show()
 
 # Make a plot of the simulation using matplotlib and show it to the user
-# If save_to is specified, the plot is saved to whatever directory is specified by the user.
-def plot(simulation: Simulation, ax: Axes):
+# Every path is drawn in a single collection, decimated to one column per pixel of the axes (or to columns),
+# so long runs with many particles still draw quickly. An Ensemble can be plotted too, with all of its replicas.
+# Past max_paths particles, the paths stop meaning anything, so a kymograph is drawn instead,
+# or with sample, only max_paths of the paths, evenly spread over the particles (and replicas).
+def plot(simulation: Simulation, ax: Axes, columns: int = None, max_paths: int = 1000, sample: bool = False):
+    paths = simulation.num_particles * getattr(simulation, 'replicas', 1)
+    if paths > max_paths and not sample:
+        plot_kymograph(simulation, ax)
+        return
+
+    particles = np.arange(paths)
+    if paths > max_paths:
+        particles = np.unique(np.linspace(0, paths - 1, max_paths).round().astype(int))
 
     # The time values to plot against
-    t_values = [i * simulation.dt for i in range(simulation.current_step)]
+    t_values = np.arange(simulation.current_step) * simulation.dt
 
-    for particle in simulation.particles:
-        ax.scatter(t_values, particle.history, s=2)
+    if columns is None:
+        columns = max(int(ax.get_window_extent().width), 1)
 
+    # The positions are read a chunk of particles at a time, and only the decimated segments are kept
+    def read(indices):
+        return simulation.get_positions(particles=indices)
+
+    segments, owners = trajectories.trajectory_segments(t_values, read, particles, simulation.L, columns)
+
+    # Every particle gets the color it would have had from the color cycle, if it were drawn on its own
+    cycle = colors.to_rgba_array(plt.rcParams['axes.prop_cycle'].by_key()['color'])
+    ax.add_collection(LineCollection(segments, colors=cycle[owners % len(cycle)], linewidths=0.8))
+
+    ax.set_xlim(0, max(t_values[-1], simulation.dt))
+    ax.set_ylim(0, simulation.L)
+    ax.set_xlabel('Time (s)')
+    ax.set_ylabel('Particle position (m)')
+    ax.set_title(f'D = {simulation.D}')
+
+
+# Plots where the particles have been as a (time, x) density image, for when there are too many of them to plot their paths.
+# Uses the kymograph the simulation built while it ran, if enable_kymograph was called,
+# and otherwise builds one from the stored history with rows x columns pixels.
+# theory can be 'gaussian' or 'fourier', to draw that analytic solution over the image as levels contours.
+def plot_kymograph(simulation: Simulation, ax: Axes, log: bool = True, theory: str = None, levels: int = 6,
+                   rows: int = 512, columns: int = 512):
+    kymograph = getattr(simulation, 'kymograph', None)
+    if kymograph is None:
+        kymograph = Kymograph.from_history(simulation, rows, columns)
+
+    density = kymograph.density(getattr(simulation, 'replicas', 1))
+    t_edges = kymograph.step_edges() * simulation.dt
+
+    # Empty pixels are left blank on a log scale
+    positive = density[density > 0]
+    vmin = positive.min() if len(positive) > 0 else 1
+    vmax = max(density.max(), vmin)
+    norm = colors.LogNorm(vmin, vmax) if log else colors.Normalize(0, vmax)
+
+    image = ax.imshow(density.T, origin='lower', aspect='auto', interpolation='nearest', norm=norm,
+                      extent=(t_edges[0], t_edges[-1], 0, simulation.L))
+    ax.figure.colorbar(image, ax=ax, label='Number Density (m^-1)')
+
+    if theory is not None and kymograph.filled > 2:
+        if theory == 'gaussian':
+            f = solutions.get_gaussian_func(simulation, 5)
+        elif theory == 'fourier':
+            f = solutions.get_fourier_func(simulation, 10)
+        else:
+            raise ValueError(f"Unknown theory '{theory}', it should be 'gaussian' or 'fourier'")
+
+        # The solution is evaluated at the middle of every pixel, leaving out t = 0 where a delta start has no value
+        t_values = (t_edges[:-1] + t_edges[1:]) / 2
+        t_values = t_values[t_values > 0]
+        x_values = (np.arange(kymograph.columns) + 0.5) * simulation.L / kymograph.columns
+        z_values = np.array([f(x_values, t) for t in t_values])
+
+        if log:
+            contour_levels = np.geomspace(vmin, vmax, levels + 2)[1:-1]
+        else:
+            contour_levels = np.linspace(0, vmax, levels + 2)[1:-1]
+
+        ax.contour(t_values, x_values, z_values.T, levels=contour_levels, colors='white', linewidths=0.8)
+
+    ax.set_xlim(t_edges[0], t_edges[-1])
+    ax.set_ylim(0, simulation.L)
     ax.set_xlabel('Time (s)')
     ax.set_ylabel('Particle position (m)')
     ax.set_title(f'D = {simulation.D}')
@@ -25,53 +118,88 @@ def plot(simulation: Simulation, ax: Axes):
 
 # Make a plot of the simulation's histogram using matplotlib and show it to the user
 # If save_to is specified, the plot is saved to whatever directory is specified by the user.
-# Generates the histograms using the automatic function from matplotlib
+# Generates the histograms from the particle positions, one frame at a time as the animation plays
 # Unused
 def plot_hists(simulation: Simulation, save_to: str =None):
     num_x = simulation.histogram_config['num_x']
     num_t = simulation.histogram_config['num_t']
-    density = simulation.histogram_config['number_density']
 
     # Gets us linearly spaced t values to sample
     # Rounded using integer truncation
     # Units are multiples of dt.
     t_values = [int(np.floor(t)) for t in np.linspace(0, simulation.current_step - 1, num_t)]
-    # print(t_values)
 
     fig, ax = plt.subplots()
-    artists = []
 
-    # Stores the histograms if they are to be saved
-    hists = []
-    for t in t_values:
-        # The distribution is a snapshot of the particles we want to plot at time t
-        distribution = [particle.history[t] for particle in simulation.particles]
-        N, bins, patches = ax.hist(distribution, bins=num_x, range=(0, simulation.L), density=True)
+    # One set of bars is made up front, and only their heights and colors change from frame to frame
+    edges = np.linspace(0, simulation.L, num_x + 1)
+    bars = ax.bar(edges[:-1], np.zeros(num_x), width=edges[1] - edges[0], align='edge')
+
+    # Blitting only redraws the bars, so the axes can't rescale as they play.
+    # The tallest any bar can be is a single cell holding every particle.
+    ax.set_xlim(0, simulation.L)
+    ax.set_ylim(0, 1.05 * num_x / simulation.L)
+    norm = colors.Normalize(0, 1)
 
-        # N represents the values of the histogram bins, so we can use it to set their colors.
+    def update(frame: int) -> list:
+        # The distribution is a snapshot of the particles we want to plot at time t
+        distribution = simulation.get_positions(t_values[frame], t_values[frame] + 1)[0]
+        N, _ = np.histogram(distribution, bins=num_x, range=(0, simulation.L), density=True)
         fracs = N / N.max()
 
-        # we need to normalize the data to 0->1 for the full range of the colormap
-        if t <= 0:
-            norm = colors.Normalize(0, fracs.max())
+        for height, frac, bar in zip(N, fracs, bars):
+            bar.set_height(height)
+            bar.set_facecolor(plt.cm.viridis(norm(frac)))
 
-        # Now, we'll loop through our objects and set the color of each accordingly
-        for thisfrac, thispatch in zip(fracs, patches):
-            color = plt.cm.viridis(norm(thisfrac))
-            thispatch.set_facecolor(color)
+        return list(bars)
 
-        # Add it to our list of artists to animate
-        artists.append(patches)
+    import matplotlib.animation as animation
+    ani = animation.FuncAnimation(fig, update, frames=len(t_values), interval=125, blit=True, cache_frame_data=False)
+    show()
 
-        if save_to:
-            hists.append(N)
+    return ani
 
-    ani = animation.ArtistAnimation(fig=fig, artists=artists, interval=125)
-    plt.show()
+# Draws the flux through every bin boundary as stems, like ax.stem(edges, flux) does, but as a single
+# LineCollection for the stems and a single line of markers for their heads, which stays fast with many thousands of bins.
+# crossings is the crossings of one step (a row of bin_crossings, which is only read).
+# Returns a function that moves the same stems to show the crossings of another step, returning the artists it changed.
+def draw_flux(ax: Axes, edges, crossings, dt: float, color: str = 'C0', label: str = None) -> callable:
+    edges = np.asarray(edges, dtype=float)
 
-# Make a plot of the simulation's histogram using matplotlib and show it to the user
-# Uses stairs and pre-generated histograms instead of letting them be generated.
-def plot_hists_generated(simulation: Simulation, save_to: str =None):
+    # One (x, 0) to (x, flux) segment per boundary, of which only the flux ever changes
+    segments = np.zeros((len(edges), 2, 2))
+    segments[:, :, 0] = edges[:, np.newaxis]
+
+    def to_flux(crossings) -> np.ndarray:
+        # Shows the boundary condition better to also have the first crossing at the end
+        flux = np.empty(len(edges))
+        flux[:-1] = crossings
+        flux[-1] = crossings[0]
+
+        return flux / dt
+
+    flux = to_flux(crossings)
+    segments[:, 1, 1] = flux
+
+    stemlines = LineCollection(segments, colors=color, label=label)
+    ax.add_collection(stemlines)
+    markerline, = ax.plot(edges, flux, 'o', color=color)
+    ax.plot([edges[0], edges[-1]], [0, 0], 'C3-')
+
+    def update(crossings) -> list:
+        segments[:, 1, 1] = to_flux(crossings)
+        stemlines.set_segments(segments)
+        markerline.set_ydata(segments[:, 1, 1])
+
+        return [stemlines, markerline]
+
+    return update
+
+
+# The data of every frame of plot_hists_generated, computed up front:
+# the histograms, the crossings and both theory curves at every sampled step, and y limits that fit all of them.
+# Everything is a plain array, so the frames can be handed to other processes and drawn there.
+def hists_generated_frames(simulation: Simulation) -> dict:
     hists, edges = simulation.generate_hist()
 
     # Gets us linearly spaced t values to sample
@@ -81,64 +209,100 @@ def plot_hists_generated(simulation: Simulation, save_to: str =None):
     x_values = np.linspace(0, simulation.L, 100)
 
     # Gets only the crossings for the particular values we want
-    crossings = [simulation.bin_crossings[t] for t in t_values]
+    crossings = simulation.get_crossings()[t_values]
+
+    # The theory curves at every frame, evaluated over every x at once
+    f = simulation.get_fourier_bound_func(10)
+    g = simulation.get_gaussian_bound_func(5)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fourier_values = np.array([f(x_values, k * simulation.dt) for k in t_values])
+        gauss_values = np.array([g(x_values, k * simulation.dt) for k in t_values])
+
+    # Neither blitting nor exporting the frames one by one rescales the axes, so they're fit to every frame up front
+    finite = [values[np.isfinite(values)] for values in (hists, crossings / simulation.dt, fourier_values, gauss_values)]
+    low = min([0] + [values.min() for values in finite if len(values) > 0])
+    high = max([0] + [values.max() for values in finite if len(values) > 0])
+    margin = 0.05 * (high - low) or 1
+
+    return {
+        'edges': np.asarray(edges),
+        'x_values': x_values,
+        'hists': np.asarray(hists),
+        'crossings': crossings,
+        'dt': simulation.dt,
+        'fourier': fourier_values,
+        'gauss': gauss_values,
+        'ylim': (low - margin, high + margin),
+    }
+
+
+# Draws the first frame of plot_hists_generated on ax.
+# Returns a function that switches the same artists to any other frame, and returns the artists it changed.
+def draw_hists_generated(ax: Axes, frames: dict) -> callable:
+    edges = frames['edges']
+
+    hist_patch = ax.stairs(frames['hists'][0], edges, fill=True)
+    hist_patch.set_facecolor((0.80, 0.30, 0.50))
 
-    fig, ax = plt.subplots()
-    artists = []
-    for hist, crossing, k in zip(hists, crossings, t_values):
-        hist_patch = ax.stairs(hist, edges, fill=True)
-        hist_patch.set_facecolor((0.80, 0.30, 0.50))
+    update_flux = draw_flux(ax, edges, frames['crossings'][0], frames['dt'])
+    fourier_line, = ax.plot(frames['x_values'], frames['fourier'][0], color=(0.05, 0.50, 0.24))
+    gauss_line, = ax.plot(frames['x_values'], frames['gauss'][0], color=(0.15, 0.10, 0.40))
 
-        # Shows the boundary condition better to also have the first crossing at the end
-        crossing.append(crossing[0])
-        crossing_per_time = [c / simulation.dt for c in crossing]
-        stem_patch = ax.stem(edges, crossing_per_time)
+    ax.set_ylim(*frames['ylim'])
 
-        f = simulation.get_fourier_bound_func(10)
+    def update(frame: int) -> list:
+        hist_patch.set_data(frames['hists'][frame], edges)
 
-        y_values = [f(x, k * simulation.dt) for x in x_values]
-        fourier_patch = ax.plot(x_values, y_values, color=(0.05, 0.50, 0.24))
+        flux_artists = update_flux(frames['crossings'][frame])
 
-        g = simulation.get_gaussian_bound_func(5)
+        fourier_line.set_ydata(frames['fourier'][frame])
+        gauss_line.set_ydata(frames['gauss'][frame])
 
-        y_values = [g(x, k * simulation.dt) for x in x_values]
-        gauss_patch = ax.plot(x_values, y_values, color=(0.15, 0.10, 0.40))
+        return [hist_patch, *flux_artists, fourier_line, gauss_line]
 
-        patches = list(stem_patch)
-        patches.append(hist_patch)
+    return update
 
-        for patch in fourier_patch:
-            patches.append(patch)
 
-        for patch in gauss_patch:
-            patches.append(patch)
+# Make a plot of the simulation's histogram using matplotlib and show it to the user
+# Uses stairs and pre-generated histograms instead of letting them be generated.
+# A single set of artists is drawn, and every frame only changes their data, taken from arrays computed up front,
+# so the animation starts straight away and can have as many frames as num_t asks for.
+# To save the animation without a window, use figures.export_frames instead.
+def plot_hists_generated(simulation: Simulation, save_to: str =None):
+    frames = hists_generated_frames(simulation)
 
-        artists.append(patches)
+    fig, ax = plt.subplots()
+    update = draw_hists_generated(ax, frames)
 
-    ani = animation.ArtistAnimation(fig=fig, artists=artists, interval=500)
-    plt.show()
+    import matplotlib.animation as animation
+    ani = animation.FuncAnimation(fig, update, frames=len(frames['hists']), interval=500, blit=True,
+                                  cache_frame_data=False)
+    show()
 
     # If the user specified a save location, save the histograms to a txt
     if save_to:
         simulation.save_hist_txt(save_to)
 
+    return ani
+
 
 # Plots the values of our histograms to see their probability distribution
 # Intended to be used with a simulation initialized to a uniform distribution, with number_density = true.
 # Takes in an Axes object to be plotted alongside other graphs
-def plot_aggregated_hists(sim: Simulation, ax: Axes):
-    hists_2D, _ = sim.generate_hist()               # Get our histogram values
-    hists = reduce(lambda x, y: x + y, hists_2D)    # Reduce them to one array
-    hist = [arr[0] for arr in hists_2D]             # This gets us the statistics for just one bin if needed
+# num_x can be any coarser number of bins that divides the simulation's, so one run can be plotted at several dx.
+def plot_aggregated_hists(sim: Simulation, ax: Axes, num_x: int = None):
+    import scipy.stats as stats
+
+    num_x = num_x or sim.histogram_config['num_x']
 
     # This comes from my analysis
-    n = sim.num_particles / sim.L
-    dx = sim.L / sim.histogram_config['num_x']
-    expected_mean = n
-    expected_var = n / dx * (1 - 1/sim.histogram_config['num_x'])
+    dx = sim.L / num_x
+    expected_mean, expected_var = expected_density_stats(sim.num_particles, sim.L, num_x)
 
-    empirical_mean = np.mean(hists)
-    empirical_var = np.var(hists)
+    # The statistics are accumulated every step, and pooled over every bin
+    moments = sim.get_density_moments(num_x).pooled()
+    empirical_mean = moments.mean
+    empirical_var = moments.variance
 
     ax.text(0.97, 0.93, f"Analysis: µ={expected_mean}, σ²={expected_var:.2f}", transform=ax.transAxes, ha='right')
     ax.text(0.97, 0.86, f"Data: µ={empirical_mean}, σ²={empirical_var:.2f}", transform=ax.transAxes, ha= 'right')
@@ -148,7 +312,9 @@ def plot_aggregated_hists(sim: Simulation, ax: Axes):
 
 
 
-    ax.hist(hists, bins=int(np.log10(sim.num_particles) * 6.25), density=True, label="Simulation Data")
+    # The values were histogrammed as the simulation ran, with one bin per possible particle count
+    histogram = sim.get_density_histogram(num_x)
+    ax.stairs(histogram.density(), histogram.edges, fill=True, label="Simulation Data")
 
     sigma = np.sqrt(expected_var)
 
@@ -159,43 +325,40 @@ def plot_aggregated_hists(sim: Simulation, ax: Axes):
     ax.plot(x, stats.norm.pdf(x, expected_mean, sigma), label="Bell Curve")
 
     x_ints = [int(np.floor(t * dx)) for t in x]
-    y = [y * dx for y in stats.binom.pmf(x_ints, sim.num_particles , 1/sim.histogram_config['num_x'])]
+    y = [y * dx for y in stats.binom.pmf(x_ints, sim.num_particles , 1/num_x)]
     ax.plot(x, y, label="Binomial PMF")
 
     ax.legend(loc="upper left")
 
 
-def plot_flux_hists(sim: Simulation, ax: Axes):
-    hists_2D = sim.bin_crossings[1:]               # Get our histogram values
-    hists = [N / sim.dt for N in reduce(lambda x, y: x + y, hists_2D)]   # Reduce them to one array
-    hist = [arr[0] for arr in hists_2D]             # This gets us the statistics for just one bin if needed
+def plot_flux_hists(sim: Simulation, ax: Axes, num_x: int = None):
+    import scipy.stats as stats
+
+    num_x = num_x or sim.histogram_config['num_x']
 
     # This comes from my analysis
-    n = sim.num_particles / sim.L
-    expected_mean = 0
-    expected_var = 2 * n * np.sqrt(sim.D / (np.pi * sim.dt ** 3))
+    expected_mean, expected_var = expected_flux_stats(sim.num_particles, sim.L, sim.D, sim.dt)
 
-    empirical_mean = np.mean(hists)
-    empirical_var = np.var(hists)
+    # The statistics are accumulated every step, and pooled over every boundary
+    moments = sim.get_flux_moments(num_x).pooled()
+    empirical_mean = moments.mean
+    empirical_var = moments.variance
 
     # ax.text(0.01, 0.79, f"N={sim.num_particles}, dt={sim.dt}, D={sim.D}", transform=ax.transAxes, ha= 'left')
     ax.text(0.97, 0.93, f"Analysis: µ={expected_mean}, σ²={expected_var:.2f}", transform=ax.transAxes, ha='right')
     ax.text(0.97, 0.86, f"Data: µ={empirical_mean:.2f}, σ²={empirical_var:.2f}", transform=ax.transAxes, ha= 'right')
     ax.set_xlabel('Flux (number/second)')
     ax.set_ylabel('Probability Density')
-    ax.set_title( f"N={sim.num_particles}, D={sim.D}, dx={sim.L/sim.histogram_config['num_x']}, dt={sim.dt}")
+    ax.set_title( f"N={sim.num_particles}, D={sim.D}, dx={sim.L/num_x}, dt={sim.dt}")
 
     sigma = np.sqrt(expected_var)
 
     left = expected_mean - 5 * sigma
     right = expected_mean + 5 * sigma
 
-    bin_left = int(left * sim.dt) / sim.dt
-    bin_right = int(right * sim.dt) / sim.dt
-
-    bins = np.linspace(bin_left, bin_right, int(right * sim.dt) - int(left * sim.dt))
-
-    ax.hist(hists, bins=bins, density=True, label="Simulation Data")
+    # The values were histogrammed as the simulation ran, with one bin per possible number of crossings
+    histogram = sim.get_flux_histogram(num_x)
+    ax.stairs(histogram.density(), histogram.edges, fill=True, label="Simulation Data")
 
     x = np.linspace(left, right, 1000)
     ax.plot(x, stats.norm.pdf(x, expected_mean, sigma), label="Bell Curve")
@@ -203,23 +366,39 @@ def plot_flux_hists(sim: Simulation, ax: Axes):
     ax.legend(loc="upper left")
 
 
+# Plots how the variance of the flux falls off as it's averaged over longer windows,
+# against the sqrt(D / (pi dt^3)) law from the analysis, with the window's length standing in for dt.
+# Every window the simulation accumulated as it ran (1, 2, 4, ... steps) is used, so a single run covers the whole study.
+def plot_flux_scaling(sim: Simulation, ax: Axes):
+    windows = np.array(sim.flux_pyramid.windows)
+    variances = [sim.get_flux_moments(window=window).pooled().variance for window in windows]
+
+    dt_values = windows * sim.dt
+    expected = [expected_flux_stats(sim.num_particles, sim.L, sim.D, dt)[1] for dt in dt_values]
+
+    ax.loglog(dt_values, variances, 'o', label="Simulation Data")
+    ax.loglog(dt_values, expected, label="Analysis")
+
+    ax.set_xlabel('Averaging window (s)')
+    ax.set_ylabel('Flux variance (number²/second²)')
+    ax.set_title(f"N={sim.num_particles}, D={sim.D}, dx={sim.L/sim.histogram_config['num_x']}, dt={sim.dt}")
+    ax.legend(loc="upper right")
+
+
 def plot_hist_at_step(simulation: Simulation, t: int, ax: Axes, flux=False):
     ax.set_xlabel('x position')
     ax.set_title( f"t = {t * simulation.dt}")
 
     hist, edges = simulation.generate_single_hist_at(t)
 
-    crossings = simulation.bin_crossings[t]
+    crossings = simulation.get_crossings()[t]
     x_values = np.linspace(0, simulation.L, 250)
 
     hist_patch = ax.stairs(hist, edges, fill=True, label="Number Density (m^-1)")
     hist_patch.set_facecolor((0.80, 0.30, 0.50))
 
     if flux:
-        # Shows the boundary condition better to also have the first crossing at the end
-        crossings.append(crossings[0])
-        crossing_per_time = [c / simulation.dt for c in crossings]
-        ax.stem(edges, crossing_per_time, label="Flux (s^-1)", linefmt="orange")
+        draw_flux(ax, edges, crossings, simulation.dt, color='orange', label="Flux (s^-1)")
 
     if flux:
         f = simulation.get_fourier_bound_func(10)
@@ -228,10 +407,11 @@ def plot_hist_at_step(simulation: Simulation, t: int, ax: Axes, flux=False):
         f = simulation.get_fourier_func(10)
         g = simulation.get_gaussian_func(5)
 
-    y_values = [f(x, t * simulation.dt) for x in x_values]
+    # The solutions take every x at once
+    y_values = f(x_values, t * simulation.dt)
     ax.plot(x_values, y_values, color=(0.08, 0.60, 0.36), label="Sine", linewidth=2)
 
-    y_values = [g(x, t * simulation.dt) for x in x_values]
+    y_values = g(x_values, t * simulation.dt)
     ax.plot(x_values, y_values, color=(0.00, 0.30, 0.45), label="Gauss", linewidth=3, linestyle='dashed')
 
     ax.legend(loc="upper left", fontsize='small')
@@ -248,7 +428,7 @@ def plot_hists_at_steps(simulation: Simulation, t_values: list[int], num_x: int,
     if save_to:
         plt.savefig(save_to)
 
-    plt.show()
+    show()
 
 
 def plot_multiple_hists(sims: list[Simulation], num_x: int, num_y: int, flux=False):
@@ -260,7 +440,7 @@ def plot_multiple_hists(sims: list[Simulation], num_x: int, num_y: int, flux=Fal
         else:
             plot_aggregated_hists(sims[i], axes[i % 2, i // 2])
 
-    plt.show()
+    show()
 
 
 def plot_multiple(sims: list[Simulation], num_x: int, num_y: int, save_to=None):
@@ -274,14 +454,4 @@ def plot_multiple(sims: list[Simulation], num_x: int, num_y: int, save_to=None):
     if save_to:
         plt.savefig(save_to)
 
-    plt.show()
-
-
-
-# Add these to the simulation class to be able to use the dot notation
-Simulation.plot = plot
-Simulation.plot_hists = plot_hists
-Simulation.plot_hists_generated = plot_hists_generated
-Simulation.plot_aggregated_hists = plot_aggregated_hists
-Simulation.plot_hist_at_step = plot_hist_at_step
-Simulation.plot_hists_at_steps = plot_hists_at_steps
\ No newline at end of file
+    show()
@@ -1,24 +1,21 @@
-from simulation import Simulation
-from matplotlib.pyplot import figure
-from plots import *
+import figures
 
-def plot_graphs():
-    sims = []
-    for i in range(1, 4):
-        sim1 = Simulation.open(f"../../out/sim6-1-{i}.json")
-        sims.append(sim1)
+# Every figure of this stage, rendered from the simulations main.py saved
+JOBS = [
+    {'figure': 'plot_multiple', 'simulations': [f"../../out/sim6-1-{i}.json" for i in range(1, 4)],
+     'args': {'num_x': 3, 'num_y': 1}, 'output': "../../out/sim6-1"},
+    {'figure': 'plot_hists_at_steps', 'simulations': ["../../out/sim6-2.json"],
+     'args': {'t_values': [1, 15, 192], 'num_x': 3, 'num_y': 1}, 'output': "../../out/sim6-2"},
+    {'figure': 'plot_hists_at_steps', 'simulations': ["../../out/sim6-3.json"],
+     'args': {'t_values': [1, 15, 460], 'num_x': 3, 'num_y': 1, 'flux': True}, 'output': "../../out/sim6-3"},
+]
 
-    plot_multiple(sims, 3, 1, save_to="../../out/sim6-1.png")
 
-    sim2 = Simulation.open("../../out/sim6-2.json")
-    sim2.initializer = lambda: 0.5
-    sim2.plot_hists_at_steps([1, 15, 192], 3, 1, save_to="../../out/sim6-2.png")
-
-    sim3 = Simulation.open("../../out/sim6-3.json")
-    sim3.initializer = lambda: 0.5
-    sim3.plot_hists_at_steps([1, 15, 460], 3, 1, flux=True, save_to="../../out/sim6-3.png")
+# Renders every figure headlessly, on as many processes as there are cores
+def plot_graphs(workers: int = None):
+    for job, paths in figures.render_figures(JOBS, workers):
+        print(f"{job['figure']}: {', '.join(paths)}")
 
 
 if __name__ == "__main__":
-    plot_graphs()
-
+    figures.main(JOBS)
@@ -0,0 +1,120 @@
+from contextlib import contextmanager
+import functools
+import time
+
+
+# Records how much time is spent in every phase of a simulation, so we can tell where a slow run spends its time.
+# Phases are named by their stack, like "Simulation.step;crossings", and the time stored for a stack excludes the
+# time spent in the phases nested inside it, which is what flamegraph tools expect.
+# Besides the totals, the time of every phase is kept for every block of block_size steps.
+class Profiler:
+    def __init__(self, block_size: int = 100):
+        self.block_size = block_size
+        self.totals = {}            # stack -> seconds, excluding nested phases
+        self.counts = {}            # stack -> number of calls
+        self.blocks = []            # one {stack: seconds} dictionary per finished block of steps
+        self.current_block = {}
+        self.steps_in_block = 0
+        self.stack = []             # The names of the phases we're currently inside of
+        self.nested = [0.0]         # The time spent in nested phases, for every level of the stack
+
+
+    # Adds time to a phase, given by its name relative to whatever phase we're currently in
+    def add(self, name: str, seconds: float, calls: int = 1):
+        stack = ";".join(self.stack + [name])
+
+        self.totals[stack] = self.totals.get(stack, 0.0) + seconds
+        self.counts[stack] = self.counts.get(stack, 0) + calls
+        self.current_block[stack] = self.current_block.get(stack, 0.0) + seconds
+
+        # The parent phase shouldn't count this time as its own
+        self.nested[-1] += seconds
+
+
+    # Adds the time since start to a phase, and returns the time now, which is where the next phase starts.
+    # This times the phases of a step one after the other, without a with block around each of them.
+    def lap(self, name: str, start: float) -> float:
+        now = time.perf_counter()
+        self.add(name, now - start)
+        return now
+
+
+    # Times everything inside the with block as a phase
+    @contextmanager
+    def timed(self, name: str):
+        self.stack.append(name)
+        self.nested.append(0.0)
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = self.nested.pop()
+            self.stack.pop()
+
+            # Only the time that wasn't spent in nested phases belongs to this one
+            self.add(name, elapsed - nested)
+            self.nested[-1] += nested
+
+            # A step that ended inside this phase couldn't close its block until now
+            if not self.stack and self.steps_in_block >= self.block_size:
+                self.end_block()
+
+
+    # Called once per simulation step, to split the timings into blocks.
+    # If it's called inside a phase, the block is closed once that phase is over, so the whole step is in it.
+    def end_step(self):
+        self.steps_in_block += 1
+        if self.steps_in_block >= self.block_size and not self.stack:
+            self.end_block()
+
+
+    def end_block(self):
+        if self.current_block:
+            self.blocks.append(self.current_block)
+
+        self.current_block = {}
+        self.steps_in_block = 0
+
+
+    # The timings so far, as a dictionary
+    def to_dict(self) -> dict:
+        return {
+            'totals': dict(self.totals),
+            'counts': dict(self.counts),
+            'blocks': self.blocks + ([self.current_block] if self.current_block else []),
+            'block_size': self.block_size,
+        }
+
+
+    # The totals in the "collapsed stack" format that flamegraph.pl and speedscope read:
+    # one line per stack, followed by its time in microseconds
+    def to_collapsed(self) -> str:
+        s = ""
+        for stack, seconds in sorted(self.totals.items()):
+            s += f"{stack} {max(int(seconds * 1e6), 0)}\n"
+
+        return s
+
+
+    def save_collapsed(self, path: str):
+        with open(path, 'w') as file:
+            file.write(self.to_collapsed())
+
+
+# Decorates a method so that it's timed as a phase whenever its object has a profiler turned on.
+# When profiling is off, this costs a single attribute check.
+def profiled(name: str):
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.profiler is None:
+                return method(self, *args, **kwargs)
+
+            with self.profiler.timed(name):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorate
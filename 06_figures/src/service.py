@@ -0,0 +1,235 @@
+from concurrent.futures import ProcessPoolExecutor
+from collections.abc import AsyncIterator
+from simulation import Simulation
+from ensemble import Ensemble
+import multiprocessing
+import threading
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+# A long running service that runs simulations for its clients, so that dashboards and notebooks can share
+# one warm set of worker processes instead of each paying for its own imports and runs.
+#
+# Clients connect over TCP and send json messages, one per line:
+#   {"type": "submit", "config": {...}, "steps": 1000}      -> {"type": "accepted", "job_id": ...}
+#   {"type": "cancel", "job_id": ...}
+#   {"type": "status"}                                      -> {"type": "status", "jobs": {...}}
+# While a job runs, the service streams a "progress" message after every block of steps, with the throughput and
+# the partial statistics, and then a final "result", "cancelled" or "error" message.
+# The config is the same dictionary load_config reads. If it has 'replicas', the job runs on an Ensemble.
+# It can also have 'save_to', a path to save the finished simulation to.
+
+
+# The partial results sent with every progress message: the pooled statistics so far, and the latest histogram
+def summarize(simulation) -> dict:
+    density = simulation.get_density_moments().pooled()
+    flux = simulation.get_flux_moments().pooled()
+    histograms, edges = simulation.generate_hist()
+
+    return {
+        'density': {'mean': float(density.mean), 'var': float(density.variance)},
+        'flux': {'mean': float(flux.mean), 'var': float(flux.variance)},
+        'histogram': histograms[-1].tolist(),
+        'edges': edges,
+    }
+
+
+# Runs a job in blocks of steps inside a worker process, reporting to the service through a queue after every block.
+# The cancel event is checked between blocks.
+def run_job(job_id: str, config: dict, steps: int, block: int, queue, cancel) -> None:
+    try:
+        params = {key: value for key, value in config.items() if key != 'save_to'}
+        simulation = Ensemble(params) if 'replicas' in params else Simulation(params)
+        particles = simulation.num_particles * getattr(simulation, 'replicas', 1)
+
+        done = 0
+        start = time.perf_counter()
+        while done < steps:
+            if cancel.is_set():
+                queue.put({'type': 'cancelled', 'job_id': job_id, 'step': done})
+                return
+
+            simulation.run_steps(min(block, steps - done))
+            done += min(block, steps - done)
+
+            elapsed = time.perf_counter() - start
+            queue.put({
+                'type': 'progress',
+                'job_id': job_id,
+                'step': done,
+                'steps': steps,
+                'steps_per_second': done / elapsed,
+                'particle_steps_per_second': done * particles / elapsed,
+                'partial': summarize(simulation),
+            })
+
+        if 'save_to' in config.keys() and isinstance(simulation, Simulation):
+            simulation.save_to(config['save_to'])
+
+        queue.put({'type': 'result', 'job_id': job_id, 'step': done, 'result': summarize(simulation)})
+    except Exception as e:
+        queue.put({'type': 'error', 'job_id': job_id, 'error': repr(e)})
+
+
+class SimulationService:
+    # workers bounds how many jobs run at once. The rest wait in the pool's queue.
+    # block is how many steps are run between progress messages.
+    def __init__(self, workers: int = None, block: int = 100):
+        self.block = block
+        self.pool = ProcessPoolExecutor(workers)
+        self.manager = multiprocessing.Manager()
+        self.events = self.manager.Queue()
+        self.jobs = {}          # job id -> {'status', 'future', 'cancel', 'listeners', 'step', 'steps'}
+        self.loop = None
+
+
+    # Reads the messages coming back from the worker processes, and hands them to the event loop
+    def forward_events(self):
+        while True:
+            message = self.events.get()
+            if message is None:
+                return
+
+            self.loop.call_soon_threadsafe(self.dispatch, message)
+
+
+    # Records a message from a worker and sends it to every client listening to that job
+    def dispatch(self, message: dict):
+        job = self.jobs.get(message['job_id'])
+        if job is None:
+            return
+
+        if message['type'] == 'progress':
+            job['status'] = 'running'
+            job['step'] = message['step']
+        else:
+            job['status'] = {'result': 'done', 'cancelled': 'cancelled', 'error': 'failed'}[message['type']]
+
+        for listener in job['listeners']:
+            listener.put_nowait(message)
+
+
+    def submit(self, config: dict, steps: int, listener: asyncio.Queue) -> str:
+        job_id = uuid.uuid4().hex[:12]
+        cancel = self.manager.Event()
+
+        self.jobs[job_id] = {'status': 'queued', 'cancel': cancel, 'listeners': [listener], 'step': 0, 'steps': steps}
+        self.jobs[job_id]['future'] = self.pool.submit(run_job, job_id, config, steps, self.block, self.events, cancel)
+
+        return job_id
+
+
+    def cancel(self, job_id: str):
+        job = self.jobs[job_id]
+        job['cancel'].set()
+
+        # A job that hasn't started yet can just be dropped from the pool's queue
+        if job['future'].cancel():
+            self.dispatch({'type': 'cancelled', 'job_id': job_id, 'step': 0})
+
+
+    def status(self) -> dict:
+        return {job_id: {'status': job['status'], 'step': job['step'], 'steps': job['steps']}
+                for job_id, job in self.jobs.items()}
+
+
+    # Talks to one client: reads its requests, and writes back the messages of the jobs it submitted
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        outgoing = asyncio.Queue()
+
+        async def write_messages():
+            while True:
+                message = await outgoing.get()
+                writer.write((json.dumps(message) + "\n").encode())
+                await writer.drain()
+
+        writing = asyncio.create_task(write_messages())
+
+        try:
+            while line := await reader.readline():
+                request = json.loads(line)
+                kind = request.get('type')
+
+                if kind == 'submit':
+                    job_id = self.submit(request['config'], request['steps'], outgoing)
+                    outgoing.put_nowait({'type': 'accepted', 'job_id': job_id})
+                elif kind == 'cancel' and request.get('job_id') in self.jobs:
+                    self.cancel(request['job_id'])
+                elif kind == 'status':
+                    outgoing.put_nowait({'type': 'status', 'jobs': self.status()})
+                else:
+                    outgoing.put_nowait({'type': 'error', 'error': f"Bad request: {request}"})
+        except (ConnectionError, json.JSONDecodeError):
+            pass
+        finally:
+            # Nobody is listening anymore, so stop the jobs of this client that are still going
+            for job_id, job in self.jobs.items():
+                if outgoing in job['listeners']:
+                    job['listeners'].remove(outgoing)
+                    if not job['listeners'] and job['status'] in ('queued', 'running'):
+                        self.cancel(job_id)
+
+            writing.cancel()
+            writer.close()
+
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 5656):
+        self.loop = asyncio.get_running_loop()
+        forwarder = threading.Thread(target=self.forward_events, daemon=True)
+        forwarder.start()
+
+        server = await asyncio.start_server(self.handle_client, host, port)
+        print(f"serving on {server.sockets[0].getsockname()}")
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.events.put(None)
+            self.pool.shutdown(cancel_futures=True)
+            self.manager.shutdown()
+
+
+# Submits a config to a running service, and yields every message about the job until it is finished
+async def submit(config: dict, steps: int, host: str = "127.0.0.1", port: int = 5656) -> AsyncIterator[dict]:
+    reader, writer = await asyncio.open_connection(host, port)
+
+    try:
+        writer.write((json.dumps({'type': 'submit', 'config': config, 'steps': steps}) + "\n").encode())
+        await writer.drain()
+
+        while line := await reader.readline():
+            message = json.loads(line)
+            yield message
+
+            if message['type'] in ('result', 'cancelled', 'error'):
+                return
+    finally:
+        writer.close()
+
+
+# Asks a running service to cancel a job, from any connection
+async def cancel(job_id: str, host: str = "127.0.0.1", port: int = 5656):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write((json.dumps({'type': 'cancel', 'job_id': job_id}) + "\n").encode())
+    await writer.drain()
+    writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs simulations for clients, streaming their progress")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=5656)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--block', type=int, default=100, help="Steps between progress messages")
+    args = parser.parse_args()
+
+    service = SimulationService(args.workers, args.block)
+    asyncio.run(service.serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,39 @@
 from collections.abc import Callable
 import numpy as np
 from simulation import Simulation
+import initializers
+
+# The analytic solutions take x as either a number or an array of positions, and evaluate all of them at once.
+
+
+# The initial condition the solutions are computed for.
+# Simulations made with a p_init callable have none on record, so the callable is evaluated once
+# and the particles are assumed to all start there. Files saved before the initial condition was recorded
+# have neither, and there's no telling what they started from.
+def get_initial_condition(sim: Simulation) -> dict:
+    if sim.initial_condition is not None:
+        return sim.initial_condition
+    if sim.initializer is None:
+        raise ValueError("The simulation has no initial condition on record, so there's no analytic solution for it")
+
+    return {'type': 'delta', 'x0': sim.initializer()}
 
 
 # Defines and returns the fourier series function
 # n is how far out to truncate it.
+# Every mode of the initial distribution decays on its own, so only its fourier coefficients are needed.
 def get_fourier_func(sim: Simulation, n: int) -> Callable[[float, float], float]:
     N = sim.num_particles
     L = sim.L
     D = sim.D
-    x_0 = sim.initializer() * L        # For now, just evaluate the initializer to get x_0.
-    m = 2 * np.pi / L               # To avoid recomputing this expression
+    k = np.arange(1, n + 1)
+    w = 2 * np.pi / L * k
+    coefficients = initializers.fourier_coefficients(get_initial_condition(sim), k)
 
     def fourier(x: float, t: float) -> float:
-        sum = 0
-        for i in range(1, n + 1):
-            w = m * i
-            sum += np.exp(-D * w ** 2 * t) * np.cos(w * (x - x_0))
+        modes = coefficients * np.exp(-D * w ** 2 * t) * np.exp(1j * np.multiply.outer(x, w))
 
-        sum *= 2
-        sum += 1
-        sum *= N / L
-
-        return sum
+        return N / L * (1 + 2 * np.sum(modes.real, axis=-1))
 
     return fourier
 
@@ -32,42 +43,58 @@ def get_fourier_bound_func(sim: Simulation, n: int) -> Callable[[float, float],
     N = sim.num_particles
     L = sim.L
     D = sim.D
-    x_0 = sim.initializer() * L        # For now, just evaluate the initializer to get x_0.
-    m = 2 * np.pi / L               # To avoid recomputing this expression
+    k = np.arange(1, n + 1)
+    w = 2 * np.pi / L * k
+    coefficients = initializers.fourier_coefficients(get_initial_condition(sim), k)
 
     def fourier(x: float, t: float) -> float:
-        sum = 0
-        for i in range(1, n + 1):
-            w = m * i
-            sum += w * np.exp(-D * w ** 2 * t) * np.sin(w * (x - x_0))
-
-        sum *= 2
-        sum *= N / L
+        modes = w * coefficients * np.exp(-D * w ** 2 * t) * np.exp(1j * np.multiply.outer(x, w))
 
-        return D * sum
+        return D * 2 * N / L * np.sum(modes.imag, axis=-1)
 
     return fourier
 
 
+# The initial condition as a sum of gaussians, as (weights, x_0, variances) in units of L,
+# or None if it isn't one (a uniform or piecewise start)
+def get_gaussian_components(sim: Simulation):
+    components = initializers.gaussian_components(get_initial_condition(sim))
+    if components is None:
+        return None
+
+    weights, x_0, variances = components
+    return weights, x_0 * sim.L, variances * sim.L ** 2
+
+
 # Defines and returns the other series function with gaussians
 # n is how far out to truncate it.
+# Uniform and piecewise starts aren't sums of gaussians, so the fourier series is used for them instead.
 def get_gaussian_func(sim: Simulation, n: int) -> Callable[[float, float], float]:
     N = sim.num_particles
     L = sim.L
     D = sim.D
-    x_0 = sim.initializer() * L        # For now, just evaluate the initializer to get x_0.
+
+    components = get_gaussian_components(sim)
+    if components is None:
+        return get_fourier_func(sim, n)
+    weights, x_0, variances = components
 
     def gaussian(x: float, t: float) -> float:
-        up_to = np.sqrt(2 * D * t) // L * 3 # This ensures we always include 3 standard deviations
+        # A gaussian start with variance s^2 spreads the same way as a point start that began s^2 / 2D earlier
+        t = t + variances / (2 * D)
+        d = np.subtract.outer(x, x_0)
+
+        # This ensures we always include 3 standard deviations, from a start anywhere in the domain
+        up_to = 3 * np.sqrt(2 * D * np.max(t)) // L + 2
         # n truncates how many gaussians we compute
-        sum = np.exp(-(x - x_0 )**2 / (4 * D * t))
+        sum = np.exp(-d**2 / (4 * D * t))
         for m in range(1, min(int(up_to), n)):
-            sum += np.exp(-(x - x_0 + m * L)**2 / (4 * D * t))
-            sum += np.exp(-(x - x_0 - m * L)**2 / (4 * D * t))
+            sum += np.exp(-(d + m * L)**2 / (4 * D * t))
+            sum += np.exp(-(d - m * L)**2 / (4 * D * t))
 
         sum *= N / (2 * np.sqrt(np.pi * D * t))
 
-        return sum
+        return np.sum(weights * sum, axis=-1)
 
     return gaussian
 
@@ -77,25 +104,26 @@ def get_gaussian_bound_func(sim: Simulation, n: int) -> Callable[[float, float],
     N = sim.num_particles
     L = sim.L
     D = sim.D
-    x_0 = sim.initializer() * L        # For now, just evaluate the initializer to get x_0.
+
+    components = get_gaussian_components(sim)
+    if components is None:
+        return get_fourier_bound_func(sim, n)
+    weights, x_0, variances = components
 
     def gaussian(x: float, t: float) -> float:
-        up_to = np.sqrt(2 * D * t) // L * 3 # This ensures we always include 3 standard deviations
+        t = t + variances / (2 * D)
+        d = np.subtract.outer(x, x_0)
+
+        # This ensures we always include 3 standard deviations, from a start anywhere in the domain
+        up_to = 3 * np.sqrt(2 * D * np.max(t)) // L + 2
         # n truncates how many gaussians we compute
-        sum = 2 * (x - x_0 ) / (4 * D * t) * np.exp(-(x - x_0 )**2 / (4 * D * t))
+        sum = d / (2 * D * t) * np.exp(-d**2 / (4 * D * t))
         for m in range(1, min(int(up_to), n)):
-            sum += (x - x_0 + m * L) / (2 * D * t) * np.exp(-(x - x_0 + m * L)**2 / (4 * D * t))
-            sum += (x - x_0 - m * L) / (2 * D * t) * np.exp(-(x - x_0 - m * L)**2 / (4 * D * t))
+            sum += (d + m * L) / (2 * D * t) * np.exp(-(d + m * L)**2 / (4 * D * t))
+            sum += (d - m * L) / (2 * D * t) * np.exp(-(d - m * L)**2 / (4 * D * t))
 
         sum *= N / (2 * np.sqrt(np.pi * D * t))
 
-        return D * sum
+        return D * np.sum(weights * sum, axis=-1)
 
     return gaussian
-
-
-
-Simulation.get_fourier_func = get_fourier_func
-Simulation.get_gaussian_func = get_gaussian_func
-Simulation.get_fourier_bound_func = get_fourier_bound_func
-Simulation.get_gaussian_bound_func = get_gaussian_bound_func
\ No newline at end of file
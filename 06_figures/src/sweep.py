@@ -0,0 +1,126 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from collections.abc import Iterator
+from simulation import Simulation
+from atomic import atomic_path
+import itertools
+import hashlib
+import ast
+import json
+import os
+
+# The parameters that live inside the histogram config rather than at the top level of a config
+HISTOGRAM_KEYS = ('num_x', 'num_t', 'number_density')
+
+
+# Expands a grid of parameter values into one config per combination.
+# grid maps a parameter name (like 'D' or 'num_x') to the list of values to try,
+# and every other parameter is taken from base.
+def expand_grid(base: dict, grid: dict[str, list]) -> list[dict]:
+    configs = []
+    keys = list(grid.keys())
+
+    for values in itertools.product(*(grid[key] for key in keys)):
+        config = json.loads(json.dumps(base))   # Deep copy, so the configs don't share a histogram config
+
+        for key, value in zip(keys, values):
+            if key in HISTOGRAM_KEYS:
+                config['histogram_config'][key] = value
+            else:
+                config[key] = value
+
+        configs.append(config)
+
+    return configs
+
+
+# The modules that decide what a run produces: the engines, and every module of ours they import, however indirectly.
+# They're found by following the imports, so a module added to the engine is never left out of the cache key.
+# Plotting, post-processing and tooling can change freely without invalidating the cache.
+ENGINE_ROOTS = ('simulation', 'ensemble')
+
+
+# Follows the imports of the engine modules through the source directory.
+# Anything imported from outside it (numpy, the standard library) is left out.
+def engine_modules(source_dir: str) -> list[str]:
+    modules = set()
+    pending = list(ENGINE_ROOTS)
+
+    while pending:
+        name = pending.pop()
+        path = os.path.join(source_dir, f"{name}.py")
+        if name in modules or not os.path.exists(path):
+            continue
+
+        modules.add(name)
+        with open(path) as file:
+            tree = ast.parse(file.read())
+
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                pending.extend(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module is not None:
+                pending.append(node.module)
+
+    return sorted(modules)
+
+
+# A hash of the source code of the simulation engine, so that cached results are recomputed whenever it changes
+def code_version() -> str:
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+
+    for name in engine_modules(source_dir):
+        with open(os.path.join(source_dir, f"{name}.py"), 'rb') as file:
+            digest.update(name.encode())
+            digest.update(file.read())
+
+    return digest.hexdigest()
+
+
+# The key a result is cached under: a hash of the full config, the number of steps and the code version
+def config_hash(config: dict, steps: int, version: str = None) -> str:
+    if version is None:
+        version = code_version()
+
+    key = json.dumps({'config': config, 'steps': steps, 'code': version}, sort_keys=True)
+
+    return hashlib.sha256(key.encode()).hexdigest()[:24]
+
+
+# Runs a single config and saves it to path.
+# The result is written to a temporary file first, so an interrupted run never leaves a broken cache entry behind.
+def run_config(config: dict, steps: int, path: str) -> str:
+    simulation = Simulation(config)
+    simulation.run_steps(steps)
+
+    with atomic_path(path) as temp_path:
+        simulation.save_to(temp_path, as_json=True)
+
+    return path
+
+
+# Runs every config for the given number of steps on a process pool, skipping the ones that are already cached.
+# Yields (config, path, cached) as soon as every result is available, cached ones first,
+# then the rest in the order they finish. Use Simulation.open(path) to load a result.
+def run_sweep(configs: list[dict], steps: int, cache_dir: str = "../../out/sweep",
+              workers: int = None) -> Iterator[tuple[dict, str, bool]]:
+    os.makedirs(cache_dir, exist_ok=True)
+    version = code_version()
+
+    pending = []
+    for config in configs:
+        path = os.path.join(cache_dir, f"{config_hash(config, steps, version)}.json")
+
+        if os.path.exists(path):
+            yield config, path, True
+        else:
+            pending.append((config, path))
+
+    if not pending:
+        return
+
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {pool.submit(run_config, config, steps, path): config for config, path in pending}
+
+        for future in as_completed(futures):
+            yield futures[future], future.result(), False
@@ -0,0 +1,100 @@
+import numpy as np
+
+# Turns the recorded positions of many particles into line segments that can be drawn as a single collection.
+# Drawing every particle as its own artist stops working beyond a few thousand particles, so instead:
+#   - the paths are unwrapped, so crossing the periodic boundary doesn't look like a jump across the domain,
+#   - every path is decimated to the min and max of each pixel column, which looks the same at that resolution,
+#   - the decimated paths are wrapped again, and split wherever they cross the boundary.
+# Positions are given as a (steps, N) array, with one column per particle.
+# Only a chunk of particles is ever read at a time, so the positions of every particle never have to be in memory at once.
+
+
+# Removes the jumps of L that wrapping adds, assuming no particle moves more than L / 2 in a single step
+def unwrap(positions: np.ndarray, L: float) -> np.ndarray:
+    return np.unwrap(positions, period=L, axis=0)
+
+
+# Reduces the steps to at most two points per column (of which there are columns),
+# keeping the lowest and highest position of every particle in each.
+# The two are ordered the way the path goes through the column, so consecutive columns join up correctly.
+# Returns the times and positions of the points, with shapes (points,) and (points, N).
+def decimate(times: np.ndarray, positions: np.ndarray, columns: int) -> tuple[np.ndarray, np.ndarray]:
+    steps = len(times)
+    if steps <= 2 * columns:
+        return times, positions
+
+    starts = np.unique(np.arange(columns) * steps // columns)
+    ends = np.append(starts[1:], steps) - 1
+
+    lows = np.minimum.reduceat(positions, starts, axis=0)
+    highs = np.maximum.reduceat(positions, starts, axis=0)
+    rising = positions[starts] <= positions[ends]
+
+    points = np.empty((2 * len(starts),) + positions.shape[1:], dtype=positions.dtype)
+    points[0::2] = np.where(rising, lows, highs)
+    points[1::2] = np.where(rising, highs, lows)
+
+    return np.repeat(times[starts], 2), points
+
+
+# Turns unwrapped paths into the segments of a LineCollection, wrapped back into [0, L).
+# A segment that crosses the boundary once is split in two where it crosses, and one that spans
+# the whole domain (the particle went all the way around within a column) becomes a single vertical line.
+# Returns the segments, with shape (segments, 2, 2) as (time, position) pairs,
+# and the index of the particle every segment belongs to.
+def wrapped_segments(times: np.ndarray, positions: np.ndarray, L: float) -> tuple[np.ndarray, np.ndarray]:
+    t_a = np.broadcast_to(times[:-1, np.newaxis], positions[:-1].shape).ravel()
+    t_b = np.broadcast_to(times[1:, np.newaxis], positions[1:].shape).ravel()
+    y_a = positions[:-1].ravel()
+    y_b = positions[1:].ravel()
+    particle = np.broadcast_to(np.arange(positions.shape[1]), positions[:-1].shape).ravel()
+
+    cell_a = np.floor(y_a / L)
+    cell_b = np.floor(y_b / L)
+    shift = cell_b - cell_a
+
+    pieces = []
+
+    # Segments that stay inside the domain
+    same = shift == 0
+    pieces.append((t_a[same], y_a[same] - cell_a[same] * L, t_b[same], y_b[same] - cell_a[same] * L, particle[same]))
+
+    # Segments that cross the boundary once, split where they cross
+    once = np.abs(shift) == 1
+    boundary = (cell_a[once] + (shift[once] > 0)) * L
+    fraction = (boundary - y_a[once]) / (y_b[once] - y_a[once])
+    t_cross = t_a[once] + fraction * (t_b[once] - t_a[once])
+    edge = np.where(shift[once] > 0, L, 0.0)
+
+    pieces.append((t_a[once], y_a[once] - cell_a[once] * L, t_cross, edge, particle[once]))
+    pieces.append((t_cross, L - edge, t_b[once], y_b[once] - cell_b[once] * L, particle[once]))
+
+    # Segments that go all the way around
+    around = np.abs(shift) > 1
+    middle = (t_a[around] + t_b[around]) / 2
+    pieces.append((middle, np.zeros(len(middle)), middle, np.full(len(middle), L), particle[around]))
+
+    t_start, y_start, t_end, y_end, owners = (np.concatenate(parts) for parts in zip(*pieces))
+    segments = np.stack([np.stack([t_start, y_start], axis=-1), np.stack([t_end, y_end], axis=-1)], axis=1)
+
+    return segments, owners
+
+
+# Everything above, done for a few particles at a time so the temporary arrays stay small.
+# read(indices) returns the (steps, len(indices)) positions of the particles with those indices,
+# and only the particles in paths are drawn. columns is how many pixel columns the paths are decimated to.
+# The owner of every segment is the index of its particle.
+def trajectory_segments(times: np.ndarray, read, paths: np.ndarray, L: float, columns: int,
+                        chunk_size: int = 1024) -> tuple[np.ndarray, np.ndarray]:
+    all_segments = []
+    all_owners = []
+
+    for start in range(0, len(paths), chunk_size):
+        chunk = paths[start:start + chunk_size]
+        decimated_times, points = decimate(times, unwrap(read(chunk), L), columns)
+        segments, owners = wrapped_segments(decimated_times, points, L)
+
+        all_segments.append(segments)
+        all_owners.append(chunk[owners])
+
+    return np.concatenate(all_segments), np.concatenate(all_owners)